@@ -31,7 +31,7 @@ class CPB_SLM:
         
         if package.header.message_type == webxiStream.WebxiStream.Header.EMessageType.e_sequence_data:
             value = package.content.sequence_blocks[0].values
-            self.CPB_values = np.array(stream.data_type_conv(data_type, value, vectLength)) / 100
+            self.CPB_values = stream.data_type_conv(data_type, value, vectLength, scaled=True)
             print(self.CPB_values)
     
     def calcFreqBands(self):
@@ -7,6 +7,7 @@ import numpy as np
 
 # Modules to convert webxi data
 import webxi.webxi_stream as webxiStream
+import webxi.webxi_fast_stream as webxiFast     # Zero-copy decoding of SequenceData
 # Help functions located in HelpFunction folder
 # Read these files to get examples on how to communicate with the SLM
 import HelpFunctions.stream_handler as stream           # SLM stream functions
@@ -18,9 +19,8 @@ import HelpFunctions.sequence_handler as seq
 # Async functions to control communication
 import HelpFunctions.websocket_handler as webSocket
 from timeit import default_timer as timer
-# Buffer and decoder for the flac stream
-from HelpFunctions.buffer import DataBuffer
-from HelpFunctions.fft import dBfft
+# Buffer shared between the stream thread and the GUI, and decoder for the flac stream
+from HelpFunctions.buffer import DataBuffer, FileBuffer
 import HelpFunctions.flac_stream_2_samples as flac2samples
 import threading
 
@@ -30,6 +30,8 @@ from HelpFunctions.FigureHandler import FigureHandler
 ip = "BK2255-000404"
 host = "http://" + ip
 sequenceID = 157
+# Set to a file name to also keep all decoded samples on disk, e.g. "flac.smp"
+recordPath = None
 
 
 class streamHandler:
@@ -37,17 +39,28 @@ class streamHandler:
         self.i = 0
         self.max_input = 15.6263 / np.sqrt(2) 
         self.streamInit()
+        # Samples as decoded (24-bit) in a memory mapped file, scaled to Pa with the calibration factor when read
+        self.recording = FileBuffer(recordPath, 2**16, np.int32, self.calibrationFactor) if recordPath else None
+        # One decoder for the whole stream, decoding into a preallocated buffer (if miniaudio supports it)
+        self.decoder = flac2samples.FlacDecoder() if flac2samples.STREAMING_DECODER else None
+        self.samples = np.empty(2**16, dtype=np.int32)
         if startStream:
             self.startStream()
     
     def decode_flac_stream(self, message, fut):
         start = timer()
-        package = webxiStream.WebxiStream.from_bytes(message)
+        package = webxiFast.WebxiFastStream.from_bytes(message)
         if package.header.message_type == webxiStream.WebxiStream.Header.EMessageType.e_sequence_data:
             # Get the encoded flac block
             flac = package.content.sequence_blocks[0]          
             # Decode the compressed samples and add it to the data bufffer 
-            DataBuffer.append(flac2samples.decode(flac, self.calibrationFactor))
+            if self.decoder is not None:
+                samples = self.decoder.decode(flac, self.samples)
+            else:
+                samples = flac2samples.decode(flac, 1).astype(np.int32)
+            if self.recording is not None:
+                self.recording.append(samples, package.header.time / 2**32)
+            DataBuffer.append(samples * self.calibrationFactor)
             end = timer()
             total = (end - start)
             if 0.0625 < total:
@@ -93,6 +106,10 @@ class streamHandler:
         streamID = stream.get_stream_ID(host, "flac ")
         # Cleaning up and deleting the stream used
         requests.delete(host + "/WebXi/Streams/" + str(streamID))
+        if self.recording is not None:
+            self.recording.close()
+        if self.decoder is not None:
+            self.decoder.close()
 
     def stopStream(self):
         self.StreamRun = False
@@ -111,15 +128,12 @@ class figureHandler(FigureHandler):
         self.plotFreq.getAxis('bottom').setLabel('Frequency', units='Hz', **self.labelStyle)
 
     def update(self):
-        signal = DataBuffer.getPart(self.chunkToShow)
+        signal = self.readBuffer(DataBuffer)
         x = np.linspace(np.min(self.axis), np.max(self.axis), len(signal))
-        freq, s_dbfs = dBfft(signal, 2**16, self.fftHamming, ref=20e-6)  #Reference = 20µPa
-        # Average the fft for a smoother plot
-        avg = s_dbfs / 3 + self.old / 3 + self.oldold / 3
+        # Averaged spectrum in dB re 20µPa of the frames completed so far
+        freq, avg = self.spectrum.average()
         self.curveTime.setData(x, signal)
         self.curveFreq.setData(freq, avg)
-        self.oldold = self.old
-        self.old = s_dbfs
         if (self.i % 5 == 0):
             # Autoscale and print min/max values every 0.5 seconds
             min_Pa = np.round(min(signal), 2)
@@ -131,7 +145,7 @@ class figureHandler(FigureHandler):
                 self.plotTime.setYRange(min_Pa * 1.2, max_Pa * 1.2)
             if (np.isinf(fft_peak) == False):
                 self.plotFreq.setYRange(fft_min, fft_peak * 1.2)
-            print(f"Min: {min_Pa} Pa, Max: {max_Pa} Pa, Peak: {fft_peak} dB SPL, Peak freq: {peak_freq} Hz")
+            print(f"Min: {min_Pa} Pa, Max: {max_Pa} Pa, Peak: {fft_peak} dB SPL, Peak freq: {peak_freq} Hz, Missed: {self.missed} samples")
         self.i += 1
 
 def on_close(event):
@@ -8,6 +8,7 @@ import pyqtgraph as pg
 
 # Modules to convert webxi data
 import webxi.webxi_stream as webxiStream
+import webxi.webxi_fast_stream as webxiFast     # Zero-copy decoding of SequenceData
 import HelpFunctions.stream_handler as stream  # SLM stream functions
 # Start/pause/Stop measurments functions
 import HelpFunctions.measurment_handler as meas
@@ -18,9 +19,8 @@ import HelpFunctions.sequence_handler as seq
 import HelpFunctions.websocket_handler as webSocket
 from timeit import default_timer as timer
 
-# Buffer and decoder for the mp3 stream
+# Buffer shared between the stream thread and the GUI, and decoder for the mp3 stream
 from HelpFunctions.buffer import DataBuffer
-from HelpFunctions.fft import dBfft
 import threading
 
 from HelpFunctions.FigureHandler import FigureHandler
@@ -44,7 +44,7 @@ class streamHandler:
 
     def decode_mp3_stream(self, message, fut):
         start = timer()
-        package = webxiStream.WebxiStream.from_bytes(message)
+        package = webxiFast.WebxiFastStream.from_bytes(message)
         if package.header.message_type == webxiStream.WebxiStream.Header.EMessageType.e_sequence_data:
             # Get the encoded mp3 block
             mp3 = package.content.sequence_blocks[0]
@@ -103,6 +103,7 @@ class streamHandler:
 
 
 class figureHandler(FigureHandler):
+    sampleRate = 32e3
 
     def axisConfig(self):
         self.plotTime.getAxis('left').setStyle(tickFont=pg.QtGui.QFont('Arial', 11))
@@ -115,15 +116,12 @@ class figureHandler(FigureHandler):
         self.plotFreq.getAxis('bottom').setLabel('Frequency', units='Hz', **self.labelStyle)
 
     def update(self):
-        signal = DataBuffer.getPart(self.chunkToShow)
+        signal = self.readBuffer(DataBuffer)
         x = np.linspace(np.min(self.axis), np.max(self.axis), len(signal))
-        freq, s_dbfs = dBfft(signal, 32e3, self.fftHamming, ref=20e-6)  #Reference = 20µPa
-        # Average the fft for a smoother plot
-        avg = s_dbfs / 3 + self.old / 3 + self.oldold / 3
+        # Averaged spectrum in dB re 20µPa of the frames completed so far
+        freq, avg = self.spectrum.average()
         self.curveTime.setData(x, signal)
         self.curveFreq.setData(freq, avg)
-        self.oldold = self.old
-        self.old = s_dbfs
         if (self.i % 5 == 0):
             # Autoscale and print min/max values every 0.5 seconds
             min_Pa = np.round(min(signal), 2)
@@ -135,7 +133,7 @@ class figureHandler(FigureHandler):
                 self.plotTime.setYRange(min_Pa * 1.2, max_Pa * 1.2)
             if (np.isinf(fft_peak) == False):
                 self.plotFreq.setYRange(fft_min, fft_peak * 1.2)
-            print(f"Min: {min_Pa} Pa, Max: {max_Pa} Pa, Peak: {fft_peak} dB SPL, Peak freq: {peak_freq} Hz")
+            print(f"Min: {min_Pa} Pa, Max: {max_Pa} Pa, Peak: {fft_peak} dB SPL, Peak freq: {peak_freq} Hz, Missed: {self.missed} samples")
         self.i += 1
 
 
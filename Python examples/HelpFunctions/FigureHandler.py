@@ -4,16 +4,30 @@ import numpy as np
 from PyQt5 import QtWidgets
 
 from abc import ABC, abstractmethod
+from HelpFunctions.fft import StreamingSpectrum
+from HelpFunctions.buffer import buffer
 
 class FigureHandler(ABC):
+    # Sampling frequency of the stream and reference of the dB scale (20µPa)
+    sampleRate = 2 ** 16
+    ref = 20e-6
+    # Spectrum frames overlap and averaging, see StreamingSpectrum
+    overlap = 0.5
+    averaging = "linear"
+    averages = 3
+
     def __init__(self):
         self.i = 0
         self.chunkToShow = 2 ** 15
         self.fftSize = self.chunkToShow
         self.fftHamming = np.hamming(self.fftSize)
-        # Used to store "old" spectrums for fft averaging
-        self.old = 0
-        self.oldold = 0
+        # Every sample read from the stream is added, so no sample is skipped or used twice
+        self.spectrum = StreamingSpectrum(self.fftSize, self.sampleRate, self.fftHamming, ref=self.ref,
+                                          overlap=self.overlap, averaging=self.averaging, averages=self.averages)
+        # The newest samples, shown in the time plot
+        self.signal = buffer(self.chunkToShow)
+        # Samples received from the stream but never shown
+        self.missed = 0
 
         self.x = np.linspace(0.0, 10, self.chunkToShow)
 
@@ -37,7 +51,7 @@ class FigureHandler(ABC):
         # Calculate the frequency vector
         self.win.nextRow()
         self.plotFreq = self.win.addPlot()
-        freq = np.arange(self.fftSize//2 + 1) / (float(self.fftSize) / 32e3)
+        freq = self.spectrum.freq
         self.curveFreq = self.plotFreq.plot(freq, np.arange(len(freq)))
         self.curveFreq.setPen(color='b', width=2, autoDownsample=True, clipToView=True)
         self.plotFreq.setXRange(0, np.max(freq))
@@ -52,6 +66,20 @@ class FigureHandler(ABC):
         self.timer.timeout.connect(self.update)
         self.timer.start(int(0.1 * 1000))
 
+    def readBuffer(self, dataBuffer):
+        """
+        Reads the samples added to a SharedBuffer by the stream thread since the previous update,
+        adds them to the spectrum and returns the newest chunkToShow samples
+        """
+        samples, missed = dataBuffer.readNew()
+        if missed:
+            # The frame being filled is not continuous anymore
+            self.spectrum.restart(missed)
+        self.missed += missed
+        self.spectrum.append(samples)
+        self.signal.append(samples)
+        return self.signal.get()
+
     def run(self):
         QtWidgets.QApplication.instance().exec_()
 
@@ -1,3 +1,4 @@
+import math
 import numpy as np
 import requests
 
@@ -15,13 +16,54 @@ def SLM_Setup_LAeq(host):
     # Enable LAeq mode on the device
     requests.put(host + "/webxi/applications/slm/setup/BBLAeq", json=True)
 
+# Levels are streamed as Int16 in 0.01 dB, so there are only 2**16 possible levels. Their
+# energy 10^(L/10) is calculated once, indexed by the Int16 level viewed as Uint16
+ENERGY_TABLE = np.power(10, np.arange(2**16, dtype=np.uint16).view(np.int16) / 1000)
+# Same table as a list, indexing a list with a Python int is faster than indexing an array
+ENERGY_LIST = ENERGY_TABLE.tolist()
+
+def energy(levels, centi_db=False):
+    """Linear energy 10^(L/10) of levels in dB.\n
+       With centi_db=True the levels are Int16 in 0.01 dB, as streamed by the device, and the
+       energy is looked up in ENERGY_TABLE. NaN levels give NaN energy"""
+    if not centi_db:
+        return np.power(10, np.asarray(levels) / 10)
+    levels = np.asarray(levels)
+    if levels.dtype.kind == "f":
+        gaps = np.isnan(levels)
+        result = ENERGY_TABLE[np.where(gaps, 0, levels).astype(np.int16).view(np.uint16)]
+        result[gaps] = np.nan
+        return result
+    return ENERGY_TABLE[levels.astype(np.int16).view(np.uint16)]
+
+def scalar_energy(level, centi_db=False):
+    """Same as energy for a single level, without the overhead of NumPy"""
+    if centi_db:
+        return ENERGY_LIST[int(level) & 0xFFFF] if level == level else math.nan
+    return 10 ** (level / 10)
+
+def level(energy):
+    """Level in dB of a linear energy, 10 * log10(energy).\n
+       Single values use math.log10, which is much faster than np.log10 on a scalar"""
+    if isinstance(energy, (float, int)) and energy > 0:
+        return 10 * math.log10(energy)
+    return 10 * np.log10(energy)
+
+def centi_db_level(energy):
+    """Level of a linear energy as Int16 in 0.01 dB, the resolution of the device"""
+    return np.clip(np.rint(1000 * np.log10(energy)), -2**15, 2**15 - 1).astype(np.int16)
+
 class MovingLeq:
     """Class to create a moving Leq object.\n
        Stores a window of Leq logging intervals to be combined into a total Leq\n
        Calling move(new_interval) on the object will overwrite the oldest value in the       
-       window, recalculate the total Leq and return it."""
+       window, recalculate the total Leq and return it.\n
+       With incremental=True the total is updated from a running energy sum in O(1).\n
+       With centi_db=True move takes Int16 levels in 0.01 dB as received (the Leq is still in dB)
+       and the energies are looked up in ENERGY_TABLE."""
 
-    def __init__(self, window_length_sec, storedata=False, windowSize=None):
+    def __init__(self, window_length_sec, storedata=False, windowSize=None, incremental=False, resum_interval=None,
+                 centi_db=False):
         self.window_length = window_length_sec
         windowSize = self.window_length * 10 + 1 if windowSize is None else windowSize
 
@@ -36,21 +78,70 @@ class MovingLeq:
         self.leq_total = 0.0
         self.window_full = False
 
+        # Incremental mode keeps a running sum of the energy in the window, so a move costs O(1)
+        # instead of O(window). The sum is recalculated every resum_interval moves to stop the
+        # floating point error of the additions and subtractions from growing
+        self.incremental = incremental
+        self.centi_db = centi_db
+        self.resum_interval = window_length_sec if resum_interval is None else resum_interval
+        self.energy_sum = 0.0
+        self.nan_count = 0
+        self.moves_since_resum = 0
+        # Values written to the window, the slots of the initial NaN fill hold no value to remove
+        self.filled = 0
+
     def total_leq(self,window):
         """ Function to combine several Leq periods into a total Leq, as per:\n
             10 * log10(10^(L1/10) + 10^(L2/10) + ... 10^(Ln/10) / n)"""
+        if self.centi_db:
+            return level(np.sum(energy(window, True)) / len(window))
         sound_Pa = np.sum(np.power(10,window/10)) / len(window)
         return 10 * np.log10(sound_Pa)
 
+    def update_energy(self, new_value):
+        """Incremental mode: remove the oldest value from the energy sum (when the window is full)
+           and add the new value. NaN values are counted instead, as they make the Leq NaN"""
+        if self.filled < self.window_length:
+            self.filled += 1
+        else:
+            old_value = self.leq_window[self.oldest_value_index]
+            if math.isnan(old_value):
+                self.nan_count -= 1
+            else:
+                old_energy = scalar_energy(old_value, self.centi_db)
+                self.energy_sum -= old_energy
+                # If a loud value leaves the window, what remains of the sum is mostly rounding error
+                if self.energy_sum < old_energy * 1e-3:
+                    self.moves_since_resum = self.resum_interval
+        if math.isnan(new_value):
+            self.nan_count += 1
+        else:
+            self.energy_sum += scalar_energy(new_value, self.centi_db)
+
+    def incremental_leq(self, n):
+        """Incremental mode: Leq of the n values in the window"""
+        self.moves_since_resum += 1
+        if self.moves_since_resum >= self.resum_interval:
+            window = self.leq_window[:n]
+            self.energy_sum = float(np.nansum(energy(window, self.centi_db)))
+            self.nan_count = int(np.count_nonzero(np.isnan(window)))
+            self.moves_since_resum = 0
+        if self.nan_count:
+            return np.nan
+        return level(self.energy_sum / n)
+
     def move(self, new_value):
         """Overwrite the oldest value in the array with the new logging interval
          and update the oldest value index to point to the next oldest value"""
+        if self.incremental:
+            self.update_energy(new_value)
         self.leq_window[self.oldest_value_index] = new_value
         self.oldest_value_index += 1
         
         # Calculate the total Leq for the moving window and return it.
         if self.window_full:            
-            self.leq_total = self.total_leq(self.leq_window)
+            self.leq_total = self.incremental_leq(self.window_length) if self.incremental else \
+                self.total_leq(self.leq_window)
             self.oldest_value_index = self.oldest_value_index % self.window_length
             if self.storedata:
                 self.leqData.move(self.leq_total)
@@ -60,7 +151,8 @@ class MovingLeq:
         # If the moving window is not full of measured data, simply calculate total Leq
         # for the data that is in the window (and ignore the empty part of the array)
         else:
-            self.leq_total = self.total_leq(self.leq_window[:self.oldest_value_index])
+            self.leq_total = self.incremental_leq(self.oldest_value_index) if self.incremental else \
+                self.total_leq(self.leq_window[:self.oldest_value_index])
             self.oldest_value_index = self.oldest_value_index % self.window_length
             if self.oldest_value_index == self.window_length - 1:
                 self.window_full = True
@@ -84,4 +176,259 @@ class LeqData:
         self.leq_window = np.insert(self.leq_window[1:], self.leq_window.size-1,new_value)
 
     def getData(self):
-        return self.leq_window
\ No newline at end of file
+        return self.leq_window
+
+
+def two_sum(a, b):
+    """a + b as (sum, rounding error), an error-free transformation (Knuth)"""
+    total = a + b
+    b_part = total - a
+    return total, (a - (total - b_part)) + (b - b_part)
+
+class MultiWindowLeq:
+    """Leq over several window lengths at once, from one stream of logged values.\n
+       window_lengths is a list of lengths (in logged values, like MovingLeq) or a dict of
+       name -> length, e.g. {"1s": 10, "1min": 600, "15min": 9000, "1h": 36000} at 100 ms logging.\n
+       The energies are kept as a cumulative sum in a ring as long as the longest window, so
+       the Leq of any window is one subtraction. move(new_value) updates all windows and
+       returns a dict of name -> Leq. Like MovingLeq a window that is not full yet uses the
+       values received so far, and NaN values make the windows holding them NaN.
+       total is the Leq of all valid values since the start."""
+
+    def __init__(self, window_lengths, centi_db=False):
+        self.windows = dict(window_lengths) if isinstance(window_lengths, dict) else \
+            {length: length for length in window_lengths}
+        self.centi_db = centi_db
+        self.size = max(self.windows.values()) + 1
+        # The energy of the first k values is cum_energy[k % size] + cum_error[k % size]. The rounding
+        # error of each addition is kept in cum_error, else a loud value in the history would cost the
+        # quiet short windows their precision. cum_nan[k % size] counts the NaN values.
+        # Lists, as indexing a list with a Python int is faster than indexing an array
+        self.cum_energy = [0.0] * self.size
+        self.cum_error = [0.0] * self.size
+        self.cum_nan = [0] * self.size
+        self.count = 0
+        self.total_energy = 0.0
+        self.total_count = 0
+        self.leqs = {}
+
+    def rebase(self):
+        """Subtract the oldest kept cumulative energy from all, so the sums stay in the order of
+           the energy of the longest window instead of growing forever"""
+        oldest = (self.count + 1) % self.size
+        base, base_error = self.cum_energy[oldest], self.cum_error[oldest]
+        for k in range(self.size):
+            self.cum_energy[k], error = two_sum(self.cum_energy[k], -base)
+            self.cum_error[k] += error - base_error
+
+    def move(self, new_value):
+        """Add a logged value and return the Leq of every window"""
+        i = self.count % self.size
+        self.count += 1
+        j = self.count % self.size
+        if new_value != new_value:
+            self.cum_energy[j] = self.cum_energy[i]
+            self.cum_error[j] = self.cum_error[i]
+            self.cum_nan[j] = self.cum_nan[i] + 1
+        else:
+            value_energy = scalar_energy(new_value, self.centi_db)
+            self.cum_energy[j], error = two_sum(self.cum_energy[i], value_energy)
+            self.cum_error[j] = self.cum_error[i] + error
+            self.cum_nan[j] = self.cum_nan[i]
+            self.total_energy += value_energy
+            self.total_count += 1
+        if j == 0:
+            self.rebase()
+        self.leqs = {name: self.leq(length) for name, length in self.windows.items()}
+        return self.leqs
+
+    def leq(self, window_length):
+        """Leq of the newest window_length values, any length up to the longest window, in O(1)"""
+        if window_length >= self.size:
+            raise Exception("Window longer than the longest window: " + str(window_length))
+        n = min(window_length, self.count)
+        if n == 0:
+            return np.nan
+        end, start = self.count % self.size, (self.count - n) % self.size
+        if self.cum_nan[end] != self.cum_nan[start]:
+            return np.nan
+        window_energy = (self.cum_energy[end] - self.cum_energy[start]) + (self.cum_error[end] - self.cum_error[start])
+        return level(max(window_energy, 0.0) / n)
+
+    @property
+    def total(self):
+        return level(self.total_energy / self.total_count) if self.total_count else np.nan
+
+def _window_energies(levels, centi_db):
+    """Energies of levels with NaN replaced by 0, and the NaN positions"""
+    energies = energy(levels, centi_db)
+    gaps = np.isnan(energies)
+    energies[gaps] = 0.0
+    return energies, gaps
+
+def _block_sums(values, length):
+    """Sums of values within blocks of length, from the start of the block (prefix) and to the end of the block (suffix)"""
+    blocks = values.reshape((-1, length) + values.shape[1:])
+    prefix = np.cumsum(blocks, axis=1).reshape(values.shape)
+    suffix = np.cumsum(blocks[:, ::-1], axis=1)[:, ::-1].reshape(values.shape)
+    return prefix, suffix
+
+def moving_leq(levels, window_length, centi_db=False, chunk_size=2**22):
+    """Moving Leq over a whole array, the same as calling MovingLeq(window_length).move on each value.\n
+       The array is cut in blocks of window_length. A window spans at most two blocks, and its energy is
+       the sum to the end of the first block plus the sum from the start of the second, so no sums are
+       subtracted and quiet windows after loud values keep their precision. Processed in chunks of
+       about chunk_size values to bound the memory use.\n
+       levels can also be 2-D (time x band), e.g. CPB spectra, to get the moving Leq of each band"""
+    levels = np.asarray(levels)
+    length = window_length
+    result = np.empty(levels.shape)
+    step = max(chunk_size // length, 1) * length
+    for start in range(0, len(levels), step):
+        stop = min(start + step, len(levels))
+        # The block before the chunk holds the start of the first windows
+        first = max(start - length, 0)
+        energies, gaps = _window_energies(levels[first:stop], centi_db)
+        padding = np.zeros((-len(energies) % length,) + energies.shape[1:])
+        energies = np.concatenate((energies, padding))
+        gaps = np.concatenate((gaps, padding.astype(bool))).astype(np.int32)
+        sums, nans = [], []
+        for values, out in ((energies, sums), (gaps, nans)):
+            prefix, suffix = _block_sums(values, length)
+            window = prefix[start - first:stop - first].copy()
+            # Add the part of the window in the previous block, except for windows that are exactly one block
+            tail = np.zeros_like(window)
+            skip = max(length - 1 - start, 0)
+            tail[skip:] = suffix[start - first + skip - length + 1:stop - first - length + 1]
+            tail[length - 1::length] = 0
+            out.append(window + tail)
+        n = np.minimum(np.arange(start + 1, stop + 1), length).reshape((-1,) + (1,) * (levels.ndim - 1))
+        with np.errstate(divide="ignore"):
+            leqs = 10 * np.log10(sums[0] / n)
+        leqs[nans[0] > 0] = np.nan
+        result[start:stop] = leqs
+    return result
+
+def block_leq(levels, block_length, centi_db=False, chunk_size=2**22):
+    """Leq of consecutive blocks of block_length values, e.g. 1 minute Leqs from 100 ms values.\n
+       The last block may be shorter. A block holding a NaN gives NaN. levels can be 2-D (time x band)"""
+    levels = np.asarray(levels)
+    count = -(-len(levels) // block_length)
+    result = np.empty((count,) + levels.shape[1:])
+    step = max(chunk_size // block_length, 1) * block_length
+    for start in range(0, len(levels), step):
+        stop = min(start + step, len(levels))
+        energies, gaps = _window_energies(levels[start:stop], centi_db)
+        padding = np.zeros((-len(energies) % block_length,) + energies.shape[1:])
+        shape = (-1, block_length) + energies.shape[1:]
+        energies = np.concatenate((energies, padding)).reshape(shape)
+        gaps = np.concatenate((gaps, padding.astype(bool))).reshape(shape)
+        n = np.full(len(energies), block_length).reshape((-1,) + (1,) * (levels.ndim - 1))
+        n[-1] -= len(padding)
+        with np.errstate(divide="ignore"):
+            leqs = 10 * np.log10(energies.sum(axis=1) / n)
+        leqs[gaps.any(axis=1)] = np.nan
+        result[start // block_length:start // block_length + len(leqs)] = leqs
+    return result
+
+class VectorMovingLeq:
+    """Moving Leq of every band of a vector, e.g. a CPB spectrum with VectorLength 11 or 33.\n
+       move(values) takes one vector and returns the Leq of each band over the newest
+       window_length vectors, the same as a MovingLeq per band. The energy of the window is
+       a running sum per band (like MovingLeq with incremental=True), so a move costs a few
+       NumPy operations on the whole vector whatever the number of bands"""
+
+    def __init__(self, window_length, bands, centi_db=False, resum_interval=None):
+        self.window_length = window_length
+        self.centi_db = centi_db
+        self.resum_interval = window_length if resum_interval is None else resum_interval
+        # Energy of each vector in the window with NaN as 0, and where the NaNs are
+        self.energies = np.zeros((window_length, bands))
+        self.gaps = np.zeros((window_length, bands), dtype=np.int64)
+        self.energy_sum = np.zeros(bands)
+        self.nan_count = np.zeros(bands, dtype=np.int64)
+        self.count = 0
+        self.moves_since_resum = 0
+        self.leq_total = np.full(bands, np.nan)
+
+    def move(self, values):
+        """Add one vector and return the Leq of each band"""
+        i = self.count % self.window_length
+        new_energies = energy(values, self.centi_db)
+        new_gaps = np.isnan(new_energies)
+        new_energies[new_gaps] = 0.0
+        if self.count >= self.window_length:
+            old_energies = self.energies[i]
+            self.energy_sum -= old_energies
+            self.nan_count -= self.gaps[i]
+            # If a loud value leaves the window, what remains of the sum is mostly rounding error
+            if (self.energy_sum < old_energies * 1e-3).any():
+                self.moves_since_resum = self.resum_interval
+        self.energy_sum += new_energies
+        self.nan_count += new_gaps
+        self.energies[i] = new_energies
+        self.gaps[i] = new_gaps
+        self.count += 1
+        n = min(self.count, self.window_length)
+        self.moves_since_resum += 1
+        if self.moves_since_resum >= self.resum_interval:
+            self.energy_sum = self.energies[:n].sum(axis=0)
+            self.nan_count = self.gaps[:n].sum(axis=0)
+            self.moves_since_resum = 0
+        with np.errstate(divide="ignore"):
+            self.leq_total = 10 * np.log10(self.energy_sum / n)
+        self.leq_total[self.nan_count > 0] = np.nan
+        return self.leq_total
+
+class VectorMultiWindowLeq:
+    """MultiWindowLeq for vectors: the Leq of every band over several window lengths from one
+       stream of vectors. move(values) returns a dict of name -> array with the Leq of each band"""
+
+    def __init__(self, window_lengths, bands, centi_db=False):
+        self.windows = dict(window_lengths) if isinstance(window_lengths, dict) else \
+            {length: length for length in window_lengths}
+        self.centi_db = centi_db
+        self.size = max(self.windows.values()) + 1
+        # Cumulative energy (with the rounding errors in cum_error) and NaN count per band, see MultiWindowLeq
+        self.cum_energy = np.zeros((self.size, bands))
+        self.cum_error = np.zeros((self.size, bands))
+        self.cum_nan = np.zeros((self.size, bands), dtype=np.int64)
+        self.count = 0
+        self.leqs = {}
+
+    def rebase(self):
+        oldest = (self.count + 1) % self.size
+        base, base_error = self.cum_energy[oldest].copy(), self.cum_error[oldest].copy()
+        self.cum_energy, error = two_sum(self.cum_energy, -base)
+        self.cum_error += error - base_error
+        self.cum_nan -= self.cum_nan[oldest].copy()
+
+    def move(self, values):
+        """Add one vector and return the Leq of each band for every window"""
+        i = self.count % self.size
+        self.count += 1
+        j = self.count % self.size
+        new_energies = energy(values, self.centi_db)
+        new_gaps = np.isnan(new_energies)
+        new_energies[new_gaps] = 0.0
+        self.cum_energy[j], error = two_sum(self.cum_energy[i], new_energies)
+        self.cum_error[j] = self.cum_error[i] + error
+        self.cum_nan[j] = self.cum_nan[i] + new_gaps
+        if j == 0:
+            self.rebase()
+        self.leqs = {name: self.leq(length) for name, length in self.windows.items()}
+        return self.leqs
+
+    def leq(self, window_length):
+        """Leq of each band over the newest window_length vectors, any length up to the longest window"""
+        if window_length >= self.size:
+            raise Exception("Window longer than the longest window: " + str(window_length))
+        n = min(window_length, self.count)
+        if n == 0:
+            return np.full(self.cum_energy.shape[1], np.nan)
+        end, start = self.count % self.size, (self.count - n) % self.size
+        window_energy = (self.cum_energy[end] - self.cum_energy[start]) + (self.cum_error[end] - self.cum_error[start])
+        with np.errstate(divide="ignore"):
+            leqs = 10 * np.log10(np.maximum(window_energy, 0.0) / n)
+        leqs[self.cum_nan[end] != self.cum_nan[start]] = np.nan
+        return leqs
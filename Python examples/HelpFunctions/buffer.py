@@ -1,27 +1,229 @@
+import os
+import time
 import numpy as np
 
 class buffer:
-    def __init__(self, size):
+    """
+    Fixed size ring buffer holding the newest samples. Writing is O(len(x)), the
+    memory is allocated once. count is the total number of samples appended so far
+    and never wraps, so count - n is the sample number of the first of the n newest samples
+    """
+    def __init__(self, size, dtype=np.float64):
         self.size = size
-        self.data = np.zeros(self.size)
+        self.data = np.zeros(self.size, dtype=dtype)
+        self.count = 0
 
     def append(self, x):
         """
         Adds data in the front of the buffer. Discard the oldest data if buffer is full
         """
-        self.data =  np.append(self.data[-(self.size - len(x)) :: ] , x)
+        x = np.asarray(x)
+        n = len(x)
+        kept = x[-self.size:] if n > self.size else x
+        start = (self.count + n - len(kept)) % self.size
+        first = min(len(kept), self.size - start)
+        self.data[start:start + first] = kept[:first]
+        self.data[:len(kept) - first] = kept[first:]
+        self.count += n
+
+    def segments(self, n = 2**16):
+        """
+        Returns the n newest points as one view of the buffer, or two views (oldest first)
+        when they wrap around the end. Nothing is copied, so the views change on the next append
+        """
+        n = min(n, self.size)
+        end = self.count % self.size
+        if n <= end:
+            return (self.data[end - n:end],)
+        if end == 0:
+            return (self.data[self.size - n:],)
+        return (self.data[end - n:], self.data[:end])
 
     def get(self):
         """
         Returns the whole buffer
         """
-        return self.data
+        return self.getPart(self.size)
 
     def getPart(self, start = 2**16):
         """
         Returns X points of the newest data.
+        A view of the buffer when the points are contiguous, else a copy
+        """
+        segments = self.segments(start)
+        return segments[0] if len(segments) == 1 else np.concatenate(segments)
+
+class SharedBuffer(buffer):
+    """
+    Ring buffer appended to by one thread (the stream) and read by one other thread (the GUI).
+    The writer never waits: it makes sequence odd while writing and even when done. The reader
+    copies the data and retries if sequence was odd or changed meanwhile (a sequence lock)
+    """
+    def __init__(self, size, dtype=np.float64):
+        super().__init__(size, dtype)
+        self.sequence = 0
+        # count at the previous snapshot, used to report the samples the reader never saw
+        self.readCount = 0
+
+    def append(self, x):
+        self.sequence += 1
+        super().append(x)
+        self.sequence += 1
+
+    def snapshot(self, n = 2**16, out = None):
+        """
+        Returns (data, missed). data is a consistent copy of the n newest points, written
+        to out if given. missed is the number of samples appended since the previous
+        snapshot that are not in data, because the reader was too slow
+        """
+        return self._read(min(n, self.size), out)
+
+    def readNew(self, out = None):
+        """
+        Returns (data, missed) like snapshot, where data is every sample appended since the
+        previous read, so a reader that keeps up sees each sample exactly once.
+        out must hold size points
+        """
+        return self._read(None, out)
+
+    def _read(self, n, out):
+        while True:
+            sequence = self.sequence
+            if sequence & 1:
+                time.sleep(0)   # Let the writer finish
+                continue
+            count = self.count
+            # n is None: the samples not read yet
+            size = min(count - self.readCount, self.size) if n is None else n
+            data = np.empty(size, dtype=self.data.dtype) if out is None else out[:size]
+            np.concatenate(self.segments(size), out=data)
+            if self.sequence == sequence:
+                break
+        missed = max(count - size - self.readCount, 0)
+        self.readCount = count
+        return data, missed
+
+class FileBuffer:
+    """
+    Samples kept in a memory mapped file instead of RAM, for recordings of hours. Only the
+    pages in use are held in memory, the OS page cache writes and drops the rest. With dtype
+    int32 the samples are stored as decoded (24-bit) and scaled by calibrationFactor when read
+    as pressure, with float32 they are stored in Pa. Slices are views of the file
+    """
+    HEADER_DTYPE = np.dtype([("magic", "S8"), ("dtype", "S8"), ("sampleRate", "<f8"),
+                             ("calibrationFactor", "<f8"), ("startTime", "<f8"), ("count", "<u8")])
+    HEADER_SIZE = 64
+    MAGIC = b"BKSAMPLE"
+
+    def __init__(self, path, sampleRate = 2**16, dtype = np.int32, calibrationFactor = 1.0, startTime = None,
+                 grow = 2**16 * 60, mode = "w+"):
+        """
+        mode "w+" creates (or overwrites) path, "r+" appends to an existing file and "r" only reads it.
+        The file is extended by grow samples (a minute at 64 kHz by default) when full
+        """
+        self.path = path
+        self.grow = grow
+        self.mode = mode
+        if mode == "w+":
+            dtype = np.dtype(dtype).newbyteorder("<")
+            self.header = np.memmap(path, dtype=self.HEADER_DTYPE, mode="w+", shape=1)
+            self.header[0] = (self.MAGIC, dtype.str, sampleRate, calibrationFactor,
+                              np.nan if startTime is None else startTime, 0)
+        else:
+            self.header = np.memmap(path, dtype=self.HEADER_DTYPE, mode=mode, shape=1)
+            if self.header["magic"][0] != self.MAGIC:
+                raise Exception("Not a sample file: " + path)
+        self.dtype = np.dtype(self.header["dtype"][0].decode())
+        self.sampleRate = float(self.header["sampleRate"][0])
+        self.calibrationFactor = float(self.header["calibrationFactor"][0])
+        self.count = int(self.header["count"][0])
+        capacity = (os.path.getsize(path) - self.HEADER_SIZE) // self.dtype.itemsize
+        self._map(max(capacity, self.count) if mode == "r" else max(capacity, self.count + grow))
+
+    def _map(self, capacity):
+        # Views handed out keep the previous map alive, so the file can grow while they are used
+        self.data = np.memmap(self.path, dtype=self.dtype, mode=self.mode if self.mode != "w+" else "r+",
+                              offset=self.HEADER_SIZE, shape=capacity) if capacity else np.empty(0, self.dtype)
+
+    @property
+    def startTime(self):
+        """
+        Time of the first sample in seconds since 1970, NaN if unknown
+        """
+        return float(self.header["startTime"][0])
+
+    def __len__(self):
+        return self.count
+
+    def append(self, x, time = None):
+        """
+        Adds samples at the end of the file. time is the time of x[0] in seconds since 1970,
+        used as startTime if that is not known yet
         """
-        return self.data[-start :: ]
+        x = np.asarray(x)
+        if np.isnan(self.startTime) and time is not None:
+            self.header["startTime"] = time - self.count / self.sampleRate
+        if self.count + len(x) > len(self.data):
+            self._map(self.count + len(x) + self.grow)
+        self.data[self.count:self.count + len(x)] = x
+        self.count += len(x)
+        self.header["count"] = self.count
+
+    def __getitem__(self, index):
+        """
+        Samples by sample index, as stored (a view for slices)
+        """
+        return self.data[:self.count][index]
+
+    def pressure(self, start = 0, stop = None):
+        """
+        Samples start to stop in Pa
+        """
+        samples = self[start:stop]
+        return samples if self.dtype.kind == "f" else samples * self.calibrationFactor
+
+    def index(self, time):
+        """
+        Sample index of a time in seconds since 1970
+        """
+        return int(round((time - self.startTime) * self.sampleRate))
+
+    def time(self, index):
+        """
+        Time in seconds since 1970 of a sample index
+        """
+        return self.startTime + index / self.sampleRate
+
+    def timeSlice(self, t0, t1):
+        """
+        Samples from time t0 to t1 (seconds since 1970), as stored
+        """
+        return self[max(self.index(t0), 0):max(self.index(t1), 0)]
+
+    def getPart(self, start = 2**16):
+        """
+        Returns X points of the newest data.
+        """
+        return self[max(self.count - start, 0):]
+
+    def flush(self):
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
+        self.header.flush()
+
+    def close(self):
+        if self.mode != "r":
+            self.flush()
+            # Cut the unused, preallocated part of the file
+            with open(self.path, "r+b") as f:
+                f.truncate(self.HEADER_SIZE + self.count * self.dtype.itemsize)
+        self.data = self.header = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
 
 # Create databuffer to store the converted package data
-DataBuffer = buffer(2**16)
\ No newline at end of file
+DataBuffer = SharedBuffer(2**16)
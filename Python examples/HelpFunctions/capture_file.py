@@ -0,0 +1,240 @@
+# Capture files for WebXi streams.
+# The capture file holds the raw WebSocket messages appended after each other, exactly
+# as received. Since every message starts with a WebXi header holding its length, the
+# file is self describing. Next to it, path + ".idx" holds one fixed size index record
+# per (message, sequence id) so messages can be found without parsing the capture.
+# The time lookups of CaptureReader assume the header times never decrease, as for one
+# stream from one device. StreamRecorder warns when a message goes back in time.
+
+import asyncio
+import bisect
+import mmap
+import os
+import struct
+import time as clock
+import warnings
+import numpy as np
+
+import webxi.webxi_fast_stream as webxiFast
+from webxi.webxi_fast_stream import EMessageType, EMessageFormat
+from webxi.webxi_encoder import TICKS_PER_SECOND, to_ticks
+
+INDEX_RECORD = struct.Struct("<QQIHH")
+INDEX_DTYPE = np.dtype([("time", "<u8"), ("offset", "<u8"), ("length", "<u4"),
+                        ("message_type", "<u2"), ("sequence_id", "<u2")])
+# Sequence id 0 is "unknown id" in WebXi, used for messages not referring to a sequence
+NO_SEQUENCE = 0
+
+def index_path(path):
+    return path + ".idx"
+
+def message_sequence_ids(header, content):
+    """Returns the sequence ids a message refers to"""
+    if header.message_type == EMessageType.e_sequence_data:
+        sequence_data = webxiFast.decode_sequence_data(content)
+        if sequence_data.message_format == EMessageFormat.raw:
+            return [block.sequence_id for block in sequence_data.sequence_blocks]
+        return [sequence_id for block in sequence_data.sequence_blocks if block is not None
+                for sequence_id in block.sequence_ids]
+    if header.message_type == EMessageType.e_aux_sequence_data:
+        number_of_sequences, = webxiFast.U2.unpack_from(content, 0)
+        sequence_ids, offset = [], 4
+        for _ in range(number_of_sequences):
+            sequence_id, number_of_values = struct.unpack_from("<HH", content, offset)
+            sequence_ids.append(sequence_id)
+            offset += 4 + 8 * number_of_values
+        return sequence_ids
+    if header.message_type == EMessageType.e_trigger:
+        return [webxiFast.U2.unpack_from(content, 0)[0]]
+    return []
+
+def _index_records(message, offset):
+    header = webxiFast.Header(message)
+    content = memoryview(message)[webxiFast.HEADER.size:webxiFast.HEADER.size + header.content_length]
+    message_type = header.message_type.value if isinstance(header.message_type, EMessageType) else header.message_type
+    sequence_ids = message_sequence_ids(header, content) or [NO_SEQUENCE]
+    return b"".join(INDEX_RECORD.pack(header.time, offset, len(message), message_type, sequence_id)
+                    for sequence_id in dict.fromkeys(sequence_ids))
+
+class StreamRecorder:
+    """Appends raw WebXi messages to a capture file and its index.\n
+       The recorder can be used directly as packetHandler, and forwards the
+       message to packetHandler if one is given"""
+
+    def __init__(self, path, packetHandler=None):
+        self.path = path
+        self.packetHandler = packetHandler
+        self.data = open(path, "ab")
+        self.index = open(index_path(path), "ab")
+        self.offset = self.data.seek(0, os.SEEK_END)
+        # Header time of the newest message, to check that times do not decrease
+        self.last_time = 0
+        if self.index.seek(0, os.SEEK_END) >= INDEX_RECORD.size:
+            with open(index_path(path), "rb") as f:
+                f.seek(-INDEX_RECORD.size, os.SEEK_END)
+                self.last_time = INDEX_RECORD.unpack(f.read(INDEX_RECORD.size))[0]
+
+    def record(self, message):
+        time = webxiFast.Header(message).time
+        if time < self.last_time:
+            warnings.warn("Message time goes back in %s (clock step or several streams), "
+                          "CaptureReader time ranges will be wrong" % self.path)
+        self.last_time = max(time, self.last_time)
+        records = _index_records(message, self.offset)
+        self.data.write(message)
+        self.index.write(records)
+        self.offset += len(message)
+
+    def __call__(self, message):
+        self.record(message)
+        if self.packetHandler is not None:
+            self.packetHandler(message)
+
+    def flush(self):
+        self.data.flush()
+        self.index.flush()
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+def rebuild_index(path):
+    """Recreate the index of a capture file by walking the message headers"""
+    with open(path, "rb") as f, open(index_path(path), "wb") as index:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = 0
+            while offset + webxiFast.HEADER.size <= size:
+                length = webxiFast.HEADER.size + webxiFast.Header(data, offset).content_length
+                if offset + length > size:
+                    break   # Incomplete last message
+                index.write(_index_records(data[offset:offset + length], offset))
+                offset += length
+
+def read_index(path):
+    """Returns the index of a capture file as a structured array"""
+    return np.fromfile(index_path(path), dtype=INDEX_DTYPE)
+
+def _messages(index):
+    """Keep the first index record of each message"""
+    first = np.ones(len(index), dtype=bool)
+    first[1:] = index["offset"][1:] != index["offset"][:-1]
+    return index[first]
+
+def _replay_delays(messages, speed):
+    if not speed:
+        return np.zeros(len(messages))
+    elapsed = (messages["time"] - messages["time"][0]).astype(np.float64) / TICKS_PER_SECOND
+    return elapsed / speed
+
+def replay(path, packetHandler, speed=None):
+    """Feed the messages of a capture file to packetHandler.\n
+       speed=1 replays in real time, speed=N N times faster and None as fast as possible"""
+    messages = _messages(read_index(path))
+    if len(messages) == 0:
+        return
+    delays = _replay_delays(messages, speed)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        t0 = clock.monotonic()
+        for (offset, length), delay in zip(messages[["offset", "length"]].tolist(), delays):
+            if speed:
+                wait = t0 + delay - clock.monotonic()
+                if wait > 0:
+                    clock.sleep(wait)
+            packetHandler(data[offset:offset + length])
+
+async def replay_async(path, packetHandler, speed=1):
+    """Same as replay, but awaitable in place of websocket_handler.next_async_websocket"""
+    messages = _messages(read_index(path))
+    if len(messages) == 0:
+        return
+    delays = _replay_delays(messages, speed)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        t0 = clock.monotonic()
+        for (offset, length), delay in zip(messages[["offset", "length"]].tolist(), delays):
+            await asyncio.sleep(max(t0 + delay - clock.monotonic(), 0) if speed else 0)
+            packetHandler(data[offset:offset + length])
+
+class _Times:
+    """Sequence of the index times, read one record at a time"""
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        return int(self.index[i]["time"])
+
+class CaptureReader:
+    """Random access to a capture file by time.\n
+       The capture and its index are memory mapped, and a time range is found by
+       binary search on the index, so only the pages of the requested messages are read.
+       The header times must not decrease through the capture (see StreamRecorder)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        # A capture without messages yet cannot be mapped
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b""
+        if not os.path.exists(index_path(path)):
+            # Capture copied without its index
+            rebuild_index(path)
+        self.index = np.memmap(index_path(path), dtype=INDEX_DTYPE, mode="r") if os.path.getsize(index_path(path)) else \
+            np.empty(0, dtype=INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.index)
+
+    def range(self, t0, t1, sequence_id=None):
+        """Index records with t0 <= time < t1 (header time in ticks), optionally for one sequence_id"""
+        # bisect only touches the ~log2(n) index records it compares with
+        times = _Times(self.index)
+        start, stop = bisect.bisect_left(times, t0), bisect.bisect_left(times, t1)
+        records = self.index[start:stop]
+        if sequence_id is not None:
+            records = records[records["sequence_id"] == sequence_id]
+        return _messages(records)
+
+    def range_seconds(self, t0, t1, sequence_id=None):
+        """Same as range, with times in seconds since 1970"""
+        return self.range(to_ticks(t0), to_ticks(t1), sequence_id)
+
+    def message(self, offset, length):
+        """A zero-copy memoryview of the message at offset"""
+        return memoryview(self.data)[offset:offset + length]
+
+    def messages(self, t0, t1, sequence_id=None):
+        """Generator of the raw messages in [t0, t1)"""
+        for offset, length in self.range(t0, t1, sequence_id)[["offset", "length"]].tolist():
+            yield self.message(offset, length)
+
+    def packages(self, t0, t1, sequence_id=None):
+        """Generator of the messages in [t0, t1) decoded with WebxiFastStream (no copies)"""
+        for message in self.messages(t0, t1, sequence_id):
+            yield webxiFast.WebxiFastStream(message)
+
+    def close(self):
+        self.index = None
+        if isinstance(self.data, mmap.mmap):
+            try:
+                self.data.close()
+            except BufferError:
+                # Memoryviews handed out are still used, they keep the map until they are released
+                pass
+        self.data = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
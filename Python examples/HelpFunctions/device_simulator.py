@@ -0,0 +1,309 @@
+# Local simulator of one or more 2245/2255 sound level meters.
+# Serves a WebXi REST tree and the WebSocket streams created through POST /WebXi/Streams
+# on the same port, so the examples and HelpFunctions can be run and load-tested without
+# a device: use ip = "127.0.0.1:8080" and host = "http://" + ip.
+#
+#   python -m HelpFunctions.device_simulator --meters 20 --port 8080 --rate 10
+
+import argparse
+import asyncio
+import base64
+import copy
+import hashlib
+import json
+import struct
+import time as clock
+from urllib.parse import urlsplit
+
+import webxi.webxi_encoder as webxiEncoder
+from webxi.webxi_fast_stream import EMessageFormat
+from HelpFunctions.traffic_generator import TrafficGenerator
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+# Sequences offered by the simulated meter, as found under /WebXi/Sequences/SLM
+SEQUENCES = {
+    "Logging": {
+        "6": {"Name": "LAeq", "DataType": "Int16", "Unit": "dB"},
+        "7": {"Name": "LCeq", "DataType": "Int16", "Unit": "dB"},
+        "8": {"Name": "LAFmax", "DataType": "Int16", "Unit": "dB"},
+        "35": {"Name": "CPBLAeq", "DataType": "Int16", "Unit": "dB", "VectorLength": 33},
+        "36": {"Name": "OctLAeq", "DataType": "Int16", "Unit": "dB", "VectorLength": 11},
+        "2": {"Name": "StartTime", "DataType": "BKTimeSpan", "Unit": "s"},
+        "3": {"Name": "ElapsedTime", "DataType": "BKTimeSpan", "Unit": "s"},
+    },
+    "Audio": {
+        "156": {"Name": "AudioMp3", "DataType": "Int16", "MessageFormat": "Mp3"},
+        "157": {"Name": "AudioFlac", "DataType": "Int32", "MessageFormat": "Flac"},
+    },
+}
+
+def _node_tree(serial_number):
+    return {
+        "Applications": {
+            "SLM": {
+                "State": "Stopped",
+                "Setup": {
+                    "DisplayScheme": 0, "ControlLoggingMode": 1, "ControlMeasurementTimeControl": 0,
+                    "BBFreqWeightA": True, "BBFreqWeightB": False, "BBFreqWeightC": False, "BBFreqWeightZ": False,
+                    "BBLAeq": True, "AudioRecordingAnalysisQuality": 0, "AudioRecordingListenQuality": 0,
+                    "NetworkEthernetSetUpIP": 0, "NetworkEthernetIPAddress": "127.0.0.1",
+                    "NetworkWifiSetUpIP": 0, "NetworkWifiIPAddress": "0.0.0.0",
+                    "ServiceServiceMode": 0, "ServiceLockSetups": 0, "ServicePassword": "",
+                },
+                "Outputs": {"LAF": 45.2, "LAeq": 47.8, "Sensitivity": 0.05},
+            },
+        },
+        "Device": {
+            "Class": "Analyzer", "Family": "SLM", "Description": "Sound Level Meter (simulated)",
+            "SerialNumber": serial_number, "Type": "-2245---", "HostName": "BK2245-" + serial_number,
+            "Version": {"Firmware": "1.0.0.0", "Hardware": "0.3.0.0", "System": "0.3.0.596"},
+            "TimeFamily": 536870912, "StartTime": webxiEncoder.to_ticks(clock.time()),
+        },
+        "Sequences": {"SLM": copy.deepcopy(SEQUENCES)},
+        "Streams": {},
+    }
+
+def _find_child(node, name):
+    """Node names are case insensitive, as on the device"""
+    for key in node:
+        if key.lower() == name.lower():
+            return key
+    return None
+
+class SimulatedStream:
+    """Generates the SequenceData messages of one stream"""
+
+    def __init__(self, meter, sequence_ids, rate):
+        self.meter = meter
+        self.sequences = {sequence_id: meter.get_sequence(sequence_id) for sequence_id in sequence_ids}
+        self.start_time = clock.time()
+        formats = {sequence.get("MessageFormat", "Raw") for sequence in self.sequences.values()}
+        if "Flac" in formats:
+            self.generator = TrafficGenerator(message_format=EMessageFormat.flac, sequence_ids=sequence_ids,
+                                              start_time=self.start_time)
+        elif "Mp3" in formats:
+            self.generator = TrafficGenerator(message_format=EMessageFormat.mp3, sequence_ids=sequence_ids,
+                                              start_time=self.start_time)
+        else:
+            self.generator = None
+            self.rate = rate
+            self.count = 0
+            self.levels = {sequence_id: TrafficGenerator(sequence_ids=[sequence_id], rate=rate,
+                                                         vector_length=sequence.get("VectorLength"))
+                           for sequence_id, sequence in self.sequences.items() if sequence["DataType"] == "Int16"}
+        if self.generator is not None:
+            self.rate = self.generator.rate
+
+    def next_message(self):
+        if self.generator is not None:
+            return self.generator.next_message()
+        elapsed = self.count / self.rate
+        blocks = []
+        for sequence_id, sequence in self.sequences.items():
+            if sequence_id in self.levels:
+                blocks += self.levels[sequence_id].next_blocks()
+            elif sequence["Name"] == "StartTime":
+                blocks.append((sequence_id, struct.pack("<Ii", 0, int(self.start_time))))
+            else:
+                blocks.append((sequence_id, struct.pack("<Ii", int(elapsed % 1 * 2**32), int(elapsed))))
+        self.count += 1
+        return webxiEncoder.encode_sequence_data(blocks, EMessageFormat.raw,
+                                                 webxiEncoder.to_ticks(self.start_time + elapsed))
+
+class SimulatedMeter:
+    """One simulated sound level meter listening on host:port"""
+
+    def __init__(self, host="127.0.0.1", port=8080, rate=10, serial_number="000000"):
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.tree = _node_tree(serial_number)
+        self.next_stream_id = 1
+        self.server = None
+
+    @property
+    def state(self):
+        return self.tree["Applications"]["SLM"]["State"]
+
+    @state.setter
+    def state(self, value):
+        self.tree["Applications"]["SLM"]["State"] = value
+
+    def get_sequence(self, sequence_id):
+        for group in self.tree["Sequences"]["SLM"].values():
+            if str(sequence_id) in group:
+                return group[str(sequence_id)]
+        raise KeyError(sequence_id)
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    # HTTP
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await reader.readuntil(b"\r\n\r\n")
+                lines = request.decode("latin-1").split("\r\n")
+                method, target, _ = lines[0].split(" ", 2)
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        key, value = line.split(":", 1)
+                        headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                if headers.get("upgrade", "").lower() == "websocket":
+                    await self._handle_websocket(target, headers, reader, writer)
+                    return
+                status, reply = self.handle_request(method, target, body)
+                data = json.dumps(reply).encode()
+                writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n"
+                              % (status, REASONS[status], len(data))).encode() + data)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def handle_request(self, method, target, body):
+        """Handle a REST request, returns (status code, JSON reply)"""
+        url = urlsplit(target)
+        names = [name for name in url.path.split("/") if name]
+        query = dict(item.split("=", 1) if "=" in item else (item, None) for item in url.query.split("&") if item)
+        query = {key.lower(): value for key, value in query.items()}
+        if not names or names[0].lower() != "webxi":
+            return 404, {"Error": "Not found"}
+        # Walk the tree with case insensitive names
+        parent, key, node = None, None, self.tree
+        for name in names[1:]:
+            child = _find_child(node, name) if isinstance(node, dict) else None
+            if child is None:
+                return 404, {"Error": "No such node: " + url.path}
+            parent, key, node = node, child, node[child]
+
+        if method == "GET":
+            return 200, node
+        if method == "PUT":
+            if "action" in query:
+                return self._action(query["action"])
+            if parent is None or isinstance(node, dict):
+                return 405, {"Error": "Cannot set a branch"}
+            parent[key] = json.loads(body or b"null")
+            return 200, None
+        if method == "POST" and node is self.tree["Streams"]:
+            return self._create_stream(json.loads(body))
+        if method == "DELETE" and parent is self.tree["Streams"]:
+            del parent[key]
+            return 200, None
+        return 405, {"Error": "Method not allowed"}
+
+    def _action(self, action):
+        action = action.lower()
+        if action in ("startpause", "pausecontinue"):
+            self.state = "Paused" if self.state == "Running" else "Running"
+        elif action == "start":
+            self.state = "Running"
+        elif action == "stop":
+            self.state = "Stopped"
+        else:
+            return 400, {"Error": "Unknown action: " + action}
+        return 200, None
+
+    def _create_stream(self, body):
+        sequence_ids = body.get("Sequences", [])
+        try:
+            for sequence_id in sequence_ids:
+                self.get_sequence(sequence_id)
+        except KeyError as e:
+            return 400, {"Error": "No such sequence: " + str(e)}
+        stream_id = str(self.next_stream_id)
+        self.next_stream_id += 1
+        self.tree["Streams"][stream_id] = {
+            "Name": body.get("Name", ""), "Direction": "FromDevice", "State": "Ready",
+            "ConnectionType": body.get("ConnectionType", "WebSocket"), "Sequences": sequence_ids,
+            "MessageTypes": body.get("MessageTypes", ["SequenceData"]),
+        }
+        return 201, {"URI": ["/WebXi/Streams/" + stream_id]}
+
+    # WebSocket
+    async def _handle_websocket(self, target, headers, reader, writer):
+        names = [name for name in urlsplit(target).path.split("/") if name]
+        stream_id = names[-1] if len(names) == 3 and names[1].lower() == "streams" else None
+        if stream_id not in self.tree["Streams"]:
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+            await writer.drain()
+            return
+        accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + WEBSOCKET_GUID).encode()).digest())
+        writer.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                     b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        node = self.tree["Streams"][stream_id]
+        node["State"] = "Open"
+        stream = SimulatedStream(self, node["Sequences"], self.rate)
+        sender = asyncio.ensure_future(self._send_stream(stream, writer))
+        try:
+            await self._read_frames(reader, writer)
+        finally:
+            sender.cancel()
+            # The device removes a stream when its connection is closed
+            self.tree["Streams"].pop(stream_id, None)
+
+    async def _send_stream(self, stream, writer):
+        t0 = clock.monotonic()
+        sent = 0
+        while True:
+            if self.state == "Running":
+                writer.write(_websocket_frame(stream.next_message()))
+                await writer.drain()
+            sent += 1
+            await asyncio.sleep(max(t0 + sent / stream.rate - clock.monotonic(), 0))
+
+    async def _read_frames(self, reader, writer):
+        """Read client frames until the client closes, answering pings"""
+        while True:
+            head = await reader.readexactly(2)
+            opcode, length = head[0] & 0x0F, head[1] & 0x7F
+            if length == 126:
+                length = int.from_bytes(await reader.readexactly(2), "big")
+            elif length == 127:
+                length = int.from_bytes(await reader.readexactly(8), "big")
+            mask = await reader.readexactly(4) if head[1] & 0x80 else bytes(4)
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(await reader.readexactly(length)))
+            if opcode == 0x8:
+                writer.write(_websocket_frame(payload[:2], opcode=0x8))
+                await writer.drain()
+                return
+            if opcode == 0x9:
+                writer.write(_websocket_frame(payload, opcode=0xA))
+
+def _websocket_frame(payload, opcode=0x2):
+    """Unmasked server to client frame, binary by default"""
+    length = len(payload)
+    if length < 126:
+        head = bytes((0x80 | opcode, length))
+    elif length < 2 ** 16:
+        head = bytes((0x80 | opcode, 126)) + length.to_bytes(2, "big")
+    else:
+        head = bytes((0x80 | opcode, 127)) + length.to_bytes(8, "big")
+    return head + payload
+
+async def run_simulators(meters=1, host="127.0.0.1", port=8080, rate=10):
+    """Start a number of simulated meters on consecutive ports and serve them until cancelled"""
+    simulators = [await SimulatedMeter(host, port + i, rate, "%06d" % (i + 1)).start() for i in range(meters)]
+    for simulator in simulators:
+        print(f"Simulated meter {simulator.tree['Device']['HostName']} on http://{host}:{simulator.port}")
+    await asyncio.gather(*(simulator.server.serve_forever() for simulator in simulators))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate WebXi sound level meters")
+    parser.add_argument("--meters", type=int, default=1, help="Number of simulated meters")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080, help="Port of the first meter")
+    parser.add_argument("--rate", type=float, default=10, help="Logging messages per second")
+    args = parser.parse_args()
+    asyncio.run(run_simulators(args.meters, args.host, args.port, args.rate))
@@ -1,4 +1,8 @@
-import numpy as np 
+import inspect
+import numpy as np
+
+# np.fft.rfft can write into a given array from NumPy 2.0
+RFFT_HAS_OUT = "out" in inspect.signature(np.fft.rfft).parameters
 
 def dBfft(x, fs, win=None, ref=32768):
     """
@@ -17,7 +21,7 @@ def dBfft(x, fs, win=None, ref=32768):
     N = len(x)  # Length of input sequence
 
     if win is None:
-        win = np.ones(1, N)
+        win = np.ones(N)
     if len(x) != len(win):
             raise ValueError('Signal and window must be of the same length')
     x = x * win
@@ -30,9 +34,224 @@ def dBfft(x, fs, win=None, ref=32768):
     # because we are using half of FFT spectrum.
     s_mag = (np.abs(sp) * np.sqrt(2)) / np.sum(win)
 
-    for i in range(len(s_mag)):
-        if s_mag[i] == 0:
-            s_mag[i] = 1e-10
+    # Avoid log10(0)
+    s_mag[s_mag == 0] = 1e-10
     # Convert to dBFS
     s_dbfs = 20 * np.log10(s_mag/ref)
-    return freq, s_dbfs
\ No newline at end of file
+    return freq, s_dbfs
+
+class SpectrumEngine:
+    """
+    dBfft for a fixed length, sampling frequency, window and reference.
+    The window normalization and frequency vector are calculated once, and each
+    spectrum is calculated in preallocated arrays, so a call costs little more than the FFT.
+
+    Calling the engine returns (freq, s_db) like dBfft. s_db is overwritten by the
+    next call, unless an array is given as out.
+    """
+    def __init__(self, N, fs, win=None, ref=32768, channels=None):
+        self.N = N
+        self.fs = fs
+        self.win = np.ones(N) if win is None else np.asarray(win, dtype=np.float64)
+        if len(self.win) != N:
+            raise ValueError('Signal and window must be of the same length')
+        self.freq = np.arange(N // 2 + 1) / (float(N) / fs)
+        # Scale of the magnitude by window and factor of 2, as in dBfft
+        self.scale = np.sqrt(2) / np.sum(self.win)
+        self.ref_db = 20 * np.log10(ref)
+        # One row per channel, see BatchSpectrumEngine
+        shape = () if channels is None else (channels,)
+        self.windowed = np.empty(shape + (N,))
+        self.sp = np.empty(shape + (N // 2 + 1,), dtype=np.complex128)
+        self.s_mag = np.empty(shape + (N // 2 + 1,))
+        self.s_db = np.empty(shape + (N // 2 + 1,))
+        self.zero = np.empty(shape + (N // 2 + 1,), dtype=bool)
+
+    def magnitude(self, x):
+        """Scaled magnitude spectrum of x, in the engine's s_mag array"""
+        if np.shape(x)[-1] != self.N:
+            raise ValueError('Signal and window must be of the same length')
+        np.multiply(x, self.win, out=self.windowed)
+        if RFFT_HAS_OUT:
+            np.fft.rfft(self.windowed, out=self.sp)
+        else:
+            self.sp[:] = np.fft.rfft(self.windowed)
+        np.abs(self.sp, out=self.s_mag)
+        self.s_mag *= self.scale
+        return self.s_mag
+
+    def __call__(self, x, out=None):
+        self.magnitude(x)
+        # Avoid log10(0)
+        np.equal(self.s_mag, 0, out=self.zero)
+        np.copyto(self.s_mag, 1e-10, where=self.zero)
+        s_db = self.s_db if out is None else out
+        np.log10(self.s_mag, out=s_db)
+        s_db *= 20
+        s_db -= self.ref_db
+        return self.freq, s_db
+
+
+class BatchSpectrumEngine(SpectrumEngine):
+    """
+    SpectrumEngine for several channels, e.g. one per meter. The frames of all channels are
+    stacked in a (channels x N) array and transformed with one rfft call, so the cost per
+    channel is the FFT only. Calling the engine with a (channels x N) array returns
+    (freq, s_db) with one spectrum per row
+    """
+    def __init__(self, channels, N, fs, win=None, ref=32768):
+        super().__init__(N, fs, win, ref, channels)
+        self.channels = channels
+        self.frames = np.empty((channels, N))
+        # Samples of each SharedBuffer never included in a frame
+        self.missed = np.zeros(channels, dtype=np.int64)
+
+    def stack(self, buffers):
+        """Copies the newest N samples of each buffer (one per channel) into frames"""
+        if len(buffers) != self.channels:
+            raise ValueError('One buffer per channel is needed')
+        for channel, (frame, data) in enumerate(zip(self.frames, buffers)):
+            if hasattr(data, "snapshot"):
+                # SharedBuffer written by another thread
+                self.missed[channel] += data.snapshot(self.N, out=frame)[1]
+            elif hasattr(data, "segments"):
+                np.concatenate(data.segments(self.N), out=frame)
+            else:
+                frame[:] = data[-self.N:]
+        return self.frames
+
+    def spectra(self, buffers, out=None):
+        """Spectrums of the newest N samples of each buffer, returns (freq, s_db)"""
+        return self(self.stack(buffers), out)
+
+
+class StreamingSpectrum:
+    """
+    Short-time spectra of a continuous stream of samples (STFT/Welch). Samples are appended
+    as they are decoded and each sample is used once per frame it belongs to: frames of N samples
+    start every hop = N * (1 - overlap) samples, whatever the size of the appended blocks.
+
+    Each frame gives one spectrogram row (dB), kept in a ring of the newest `history` rows if
+    history is set and passed to rowHandler(time, row) if given, e.g. to archive it. The power of the frames is
+    averaged for display:
+        "linear":      mean of the newest `averages` frames (all frames since reset if None)
+        "exponential": each frame weighted 1/averages, older frames decay exponentially
+    """
+    def __init__(self, N, fs, win=None, ref=32768, overlap=0.5, averaging="linear", averages=3,
+                 history=0, rowHandler=None):
+        if not 0 <= overlap < 1:
+            raise ValueError('Overlap must be at least 0 and less than 1')
+        if averaging not in ("linear", "exponential"):
+            raise ValueError('Averaging must be "linear" or "exponential"')
+        if averaging == "exponential" and not averages:
+            raise ValueError('Exponential averaging needs the number of averages (its time constant in frames)')
+        self.engine = SpectrumEngine(N, fs, win, ref)
+        self.N = N
+        self.fs = fs
+        self.freq = self.engine.freq
+        self.hop = max(N - int(round(overlap * N)), 1)
+        self.averaging = averaging
+        self.averages = averages
+        self.rowHandler = rowHandler
+        bins = len(self.freq)
+        # Samples of the frame being filled
+        self.frame = np.empty(N)
+        self.filled = 0
+        # Samples appended in total, and the number of the first sample in frame
+        self.samples = 0
+        self.frameStart = 0
+        self.power = np.empty(bins)
+        self.db = np.empty(bins)
+        # Power of the newest frames for linear averaging, or the running (exponential) average
+        self.powers = np.zeros((averages if averaging == "linear" and averages else 1, bins))
+        self.frames = 0
+        # Spectrogram, only allocated if kept (history) or handed on (rowHandler). rowCount never wraps
+        self.history = history or 0
+        self.rows = np.full((self.history, bins), np.nan) if self.history else None
+        self.rowTimes = np.full(self.history, np.nan) if self.history else None
+        self.row = np.empty(bins) if rowHandler is not None and not self.history else None
+        self.rowCount = 0
+
+    def append(self, x):
+        """Adds samples to the stream and calculates every frame completed by them"""
+        x = np.asarray(x)
+        position = 0
+        while position < len(x):
+            n = min(self.N - self.filled, len(x) - position)
+            self.frame[self.filled:self.filled + n] = x[position:position + n]
+            self.filled += n
+            position += n
+            if self.filled == self.N:
+                self._frame()
+                # Keep the overlapping samples for the next frame
+                self.frame[:self.N - self.hop] = self.frame[self.hop:]
+                self.filled = self.N - self.hop
+                self.frameStart += self.hop
+        self.samples += len(x)
+
+    def restart(self, gap=0):
+        """Drops the samples of the unfinished frame, e.g. after gap samples were lost.
+        The next frame starts after the gap, so the times of the rows stay correct.
+        Averages and spectrogram are kept"""
+        self.samples += gap
+        self.frameStart = self.samples
+        self.filled = 0
+
+    def reset(self):
+        """Clears the averages"""
+        self.powers[:] = 0
+        self.frames = 0
+
+    def _frame(self):
+        np.square(self.engine.magnitude(self.frame), out=self.power)
+        if self.averaging == "linear":
+            if len(self.powers) == 1 and not self.averages:
+                self.powers[0] += self.power
+            else:
+                self.powers[self.frames % len(self.powers)] = self.power
+        else:
+            # Weight 1/k for the first frames, so the average starts at the first spectrum
+            weight = 1 / min(self.frames + 1, self.averages)
+            self.powers[0] += weight * (self.power - self.powers[0])
+        self.frames += 1
+        if self.rows is None and self.rowHandler is None:
+            return
+        row = self.row if self.rows is None else self.rows[self.rowCount % self.history]
+        self._to_db(self.power, row)
+        time = self.frameStart / self.fs
+        if self.rows is not None:
+            self.rowTimes[self.rowCount % self.history] = time
+        self.rowCount += 1
+        if self.rowHandler is not None:
+            self.rowHandler(time, row)
+
+    def _to_db(self, power, out):
+        # Avoid log10(0), as in dBfft
+        np.maximum(power, 1e-20, out=out)
+        np.log10(out, out=out)
+        out *= 10
+        out -= self.engine.ref_db
+        return out
+
+    def average(self, out=None):
+        """Returns (freq, s_db) of the averaged power. s_db is overwritten by the next call,
+        unless an array is given as out"""
+        out = self.db if out is None else out
+        if self.averaging == "exponential":
+            power = self.powers[0]
+        elif len(self.powers) == 1 and not self.averages:
+            power = np.divide(self.powers[0], max(self.frames, 1), out=self.power)
+        else:
+            power = np.mean(self.powers[:min(self.frames, len(self.powers))] if self.frames else self.powers,
+                            axis=0, out=self.power)
+        return self.freq, self._to_db(power, out)
+
+    def spectrogram(self, n=None):
+        """Returns (times, rows) of the n newest spectrogram rows, oldest first.
+        times are the start of each frame in seconds from the first appended sample.
+        Empty unless the spectrum was created with a history"""
+        if self.rows is None:
+            return np.empty(0), np.empty((0, len(self.freq)))
+        n = min(self.rowCount, self.history) if n is None else min(n, self.rowCount, self.history)
+        indexes = np.arange(self.rowCount - n, self.rowCount) % self.history
+        return self.rowTimes[indexes], self.rows[indexes]
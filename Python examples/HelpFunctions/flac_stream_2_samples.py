@@ -1,6 +1,14 @@
 import miniaudio
 import numpy as np
 from io import BytesIO  
+from functools import lru_cache
+from miniaudio import ffi, lib
+
+# Largest block size in samples a FLAC STREAMINFO can hold
+MAX_BLOCK_SIZE = 2**16 - 1
+# FlacDecoder feeds miniaudio through the read/seek callbacks of pyminiaudio's own stream decoders,
+# which are not a public API. They are checked for, and the version is pinned in requirements.txt
+STREAMING_DECODER = hasattr(lib, "_internal_decoder_read_callback") and hasattr(lib, "_internal_decoder_seek_callback")
 
 class BitBuffer:
 	def __init__(self, buf):
@@ -27,38 +35,122 @@ class BitBuffer:
 	def __exit__(self, type, value, traceback):
 		return
 
+@lru_cache(maxsize=32)
+def streaminfo_header(MAXBLOCKSIZE=MAX_BLOCK_SIZE, NUMCHANNEL=1, BITDEPTH=24, SAMPLEDATALENGTH=4096, SAMPLERATE=2**16):
+	"""fLaC marker and STREAMINFO block as bytes. Built once per stream format, the packets of a
+	stream only differ in the frame. MAXBLOCKSIZE is the block size in samples"""
+	fp = BytesIO()
+	with BitBuffer(fp) as buf:
+		# Stream
+		buf.write_int(32, 0x664C6143)  # fLaC
+		# METADATA_BLOCK_HEADER
+		buf.write_int(1, 1)
+		buf.write_int(7, 0)
+		buf.write_int(24, 34)
+		# METADATA_BLOCK_STREAMINFO
+		buf.write_int(16, MAXBLOCKSIZE)     # BLOCK SIZE
+		buf.write_int(16, MAXBLOCKSIZE)     # BLOCK SIZE
+		buf.write_int(24, 0)                # Frame size
+		buf.write_int(24, 0)                # Frame size
+		buf.write_int(20, SAMPLERATE)       # SAMPLERATE
+		buf.write_int(3, NUMCHANNEL - 1)   # NumChannels
+		buf.write_int(5, BITDEPTH - 1)   # BIT DEPTH
+		buf.write_int(36, SAMPLEDATALENGTH)
+		buf.write_int(128, 0)               # MD5 signature (unknown)
+	return fp.getvalue()
+
+def frame_bytes(frame):
+	"""The frame as a bytes-like object, Kaitai parsers give a list of ints"""
+	return frame if isinstance(frame, (bytes, bytearray, memoryview)) else bytes(frame)
+
+def flac_file(frame, NUMCHANNEL=1, BITDEPTH=24, SAMPLERATE=2**16):
+	"""One frame from the stream as a complete FLAC file, the frame is copied once.
+
+	The samples per frame are not known from the packet (frame_length is in bytes),
+	so the largest block size is announced and one cached header serves all packets"""
+	header = streaminfo_header(MAX_BLOCK_SIZE, NUMCHANNEL, BITDEPTH, SAMPLERATE=SAMPLERATE)
+	return b"".join((header, frame_bytes(frame)))
+
 def add_header(buf, BLOCK_SIZE,  NUMCHANNEL=1, BITDEPTH=24, SAMPLEDATALENGTH=4096, stream_data=0):
-    # Stream
-	buf.write_int(32, 0x664C6143)  # fLaC
-	# METADATA_BLOCK_HEADER
-	buf.write_int(1, 1)
-	buf.write_int(7, 0)
-	buf.write_int(24, 34)
-	# METADATA_BLOCK_STREAMINFO
-	buf.write_int(16, BLOCK_SIZE * 3)   # BLOCK SIZE
-	buf.write_int(16, BLOCK_SIZE * 3)   # BLOCK SIZE
-	buf.write_int(24, 0)                # Frame size
-	buf.write_int(24, 0)                # Frame size
-	buf.write_int(20, 2**16)            # SAMPLERATE
-	buf.write_int(3, NUMCHANNEL - 1)   # NumChannels
-	buf.write_int(5, BITDEPTH - 1)   # BIT DEPTH
-	buf.write_int(36, SAMPLEDATALENGTH)
-	for _ in range(16):
-		buf.write_int(8, 0)
-
-    # End flac header begin of writing data
-	for t in stream_data:
-	    buf.write_int(8, t)
-	    
+	# The header is a whole number of bytes, so a byte aligned buffer gets it and the frame directly
+	buf.out.write(streaminfo_header(min(BLOCK_SIZE * 3, MAX_BLOCK_SIZE), NUMCHANNEL, BITDEPTH, SAMPLEDATALENGTH))
+	buf.out.write(frame_bytes(stream_data))
+
 def decode(flac_stream, calibrationFactor):
-    # Add the header in front of the encoded samples 
-    fp = BytesIO()
-    with BitBuffer(fp) as buf:
-        add_header(buf, BLOCK_SIZE=flac_stream.frame_length, stream_data = flac_stream.frame)
-        fp.seek(0)
-		# Decode samples  
-        tmp = miniaudio.flac_read_s32(fp.read())
-	# now the samples is scaled to Pa 
-    tmp = (np.array(tmp.samples) >> 8) # 32 bit -> 24 bit 
-    samples = tmp * calibrationFactor
-    return samples 
\ No newline at end of file
+	# Add the header in front of the encoded samples and decode
+	tmp = miniaudio.flac_read_s32(flac_file(flac_stream.frame))
+	# now the samples is scaled to Pa
+	tmp = (np.array(tmp.samples) >> 8) # 32 bit -> 24 bit
+	samples = tmp * calibrationFactor
+	return samples
+
+
+class _FrameSource(miniaudio.StreamableSource):
+	# Hands the frame of the current packet to the decoder, nothing is buffered between packets
+	def __init__(self):
+		self.frame = memoryview(b"")
+		self.offset = 0
+
+	def read(self, num_bytes):
+		data = self.frame[self.offset:self.offset + num_bytes]
+		self.offset += len(data)
+		return data
+
+class FlacDecoder:
+	"""
+	FLAC decoder kept open for a whole stream. The STREAMINFO header is parsed once when the
+	decoder is created, and each packet's frame is then decoded by the same decoder straight into
+	a NumPy int32 buffer, without building a FLAC file or converting a Python array per packet.
+	The samples are shifted to BITDEPTH bits as decoded by the device, e.g. 24-bit
+	"""
+	def __init__(self, NUMCHANNEL=1, BITDEPTH=24, SAMPLERATE=2**16):
+		if not STREAMING_DECODER:
+			raise Exception("FlacDecoder needs miniaudio 1.71 (see requirements.txt), use decode instead")
+		self.channels = NUMCHANNEL
+		self.shift = 32 - BITDEPTH
+		self.source = _FrameSource()
+		self.source.ffi_handle = ffi.new_handle(self.source)
+		self.decoder = ffi.new("ma_decoder *")
+		config = lib.ma_decoder_config_init(lib.ma_format_s32, NUMCHANNEL, SAMPLERATE)
+		config.encodingFormat = miniaudio.FileFormat.FLAC.value
+		# The block size of the frames is not known, so the largest possible (65535 samples) is announced,
+		# and the length of the stream is unknown (0)
+		self.source.frame = memoryview(streaminfo_header(MAX_BLOCK_SIZE, NUMCHANNEL, BITDEPTH, SAMPLEDATALENGTH=0,
+			SAMPLERATE=SAMPLERATE))
+		result = lib.ma_decoder_init(lib._internal_decoder_read_callback, lib._internal_decoder_seek_callback,
+			self.source.ffi_handle, ffi.addressof(config), self.decoder)
+		if result != lib.MA_SUCCESS:
+			raise Exception(f"Failed to initialize FLAC decoder: {result}")
+		self.framesRead = ffi.new("ma_uint64 *")
+		self.samples = np.empty(MAX_BLOCK_SIZE * NUMCHANNEL, dtype=np.int32)
+
+	def decode(self, flac_stream, out=None):
+		"""
+		Decodes the frame of one FlacSequenceDataBlock into out (a C contiguous int32 array of at least
+		65535 samples per channel, interleaved), or into the decoder's own buffer which is overwritten
+		by the next packet. Returns a view of the decoded samples
+		"""
+		out = self.samples if out is None else out
+		self.source.frame = memoryview(frame_bytes(flac_stream.frame))
+		self.source.offset = 0
+		result = lib.ma_decoder_read_pcm_frames(self.decoder, ffi.from_buffer("int32_t[]", out, require_writable=True),
+			len(out) // self.channels, self.framesRead)
+		if self.source.error_in_readcallback is not None:
+			raise self.source.error_in_readcallback
+		# MA_AT_END: only a part of a frame was received
+		if result not in (lib.MA_SUCCESS, lib.MA_AT_END):
+			raise Exception(f"Failed to decode FLAC frame: {result}")
+		samples = out[:self.framesRead[0] * self.channels]
+		samples >>= self.shift
+		return samples
+
+	def close(self):
+		if self.decoder is not None:
+			lib.ma_decoder_uninit(self.decoder)
+			self.decoder = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.close()
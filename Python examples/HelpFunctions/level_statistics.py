@@ -0,0 +1,136 @@
+# Statistical levels (LN, e.g. L10, L50 and L90) from a stream of logged levels.
+# Levels arrive as Int16 in 0.01 dB, so a histogram with one bin per 0.01 dB holds
+# every level exactly. Adding a level is one increment, and LN is found by walking
+# the cumulative count, first over groups of bins and then within one group.
+
+import numpy as np
+
+from HelpFunctions.Leq import ENERGY_TABLE, level
+
+BINS = 2 ** 16
+OFFSET = 2 ** 15        # Bin of level 0 dB, bins run from -327.68 to 327.67 dB
+GROUP = 2 ** 8          # Bins per group in the coarse histogram
+# Energy of the level of each bin, in bin order
+BIN_ENERGY = np.roll(ENERGY_TABLE, OFFSET)
+
+def to_bin(value, centi_db=False):
+    """Histogram bin of a level in dB (or Int16 in 0.01 dB with centi_db=True)"""
+    return (int(value) if centi_db else int(round(value * 100))) + OFFSET
+
+def to_bins(values, centi_db=False):
+    """Histogram bins of an array of levels, -1 for NaN"""
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        gaps = np.isnan(values)
+        bins = np.where(gaps, 0, values if centi_db else np.round(values * 100)).astype(np.int64) + OFFSET
+        bins[gaps] = -1
+        return bins
+    return values.astype(np.int64) + OFFSET
+
+class LevelHistogram:
+    """Histogram of levels with 0.01 dB bins, to find the level exceeded N % of the time.\n
+       window_length limits the histogram to the newest window_length values (a sliding window),
+       None keeps all values. NaN values (gaps) are not counted, but take their place in the window.
+       With centi_db=True the levels are Int16 in 0.01 dB as received, else levels in dB"""
+
+    def __init__(self, window_length=None, centi_db=False):
+        self.window_length = window_length
+        self.centi_db = centi_db
+        self.counts = np.zeros(BINS, dtype=np.int64)
+        self.group_counts = np.zeros(BINS // GROUP, dtype=np.int64)
+        self.n = 0
+        if window_length is not None:
+            # Bin of each value in the window, -1 for NaN
+            self.ring = np.full(window_length, -1, dtype=np.int64)
+            self.head = 0
+
+    def add(self, value):
+        """Add one level, expiring the oldest level of a full window. O(1)"""
+        new_bin = -1 if value != value else to_bin(value, self.centi_db)
+        if self.window_length is not None:
+            old_bin = int(self.ring[self.head])
+            if old_bin >= 0:
+                self.counts[old_bin] -= 1
+                self.group_counts[old_bin // GROUP] -= 1
+                self.n -= 1
+            self.ring[self.head] = new_bin
+            self.head = (self.head + 1) % self.window_length
+        if new_bin >= 0:
+            self.counts[new_bin] += 1
+            self.group_counts[new_bin // GROUP] += 1
+            self.n += 1
+
+    def add_array(self, values):
+        """Add many levels at once, e.g. from a replayed capture"""
+        bins = to_bins(values, self.centi_db)
+        if self.window_length is not None:
+            if len(bins) >= self.window_length:
+                # All current values expire
+                self.clear()
+                bins = bins[-self.window_length:]
+            positions = (self.head + np.arange(len(bins))) % self.window_length
+            expired = self.ring[positions]
+            self._count(expired[expired >= 0], -1)
+            self.ring[positions] = bins
+            self.head = (self.head + len(bins)) % self.window_length
+        self._count(bins[bins >= 0], 1)
+
+    def _count(self, bins, sign):
+        counts = np.bincount(bins, minlength=BINS)
+        self.counts += sign * counts
+        self.group_counts += sign * counts.reshape(-1, GROUP).sum(axis=1)
+        self.n += sign * len(bins)
+
+    def clear(self):
+        self.counts[:] = 0
+        self.group_counts[:] = 0
+        self.n = 0
+        if self.window_length is not None:
+            self.ring[:] = -1
+            self.head = 0
+
+    def merge(self, other):
+        """Add the counts of another histogram, e.g. to combine hours into a day or several meters.\n
+           Only histograms without a window can be merged into"""
+        if self.window_length is not None:
+            raise Exception("Cannot merge into a histogram with a sliding window")
+        self.counts += other.counts
+        self.group_counts += other.group_counts
+        self.n += other.n
+        return self
+
+    def __add__(self, other):
+        result = LevelHistogram(centi_db=self.centi_db)
+        return result.merge(self).merge(other)
+
+    def percentile_bin(self, N):
+        """Lowest bin with at least 100 - N % of the values at or below it"""
+        # Integer ceil((100 - N) * n / 100), as 1 - N / 100 is not exact in floating point
+        target = max(-(-(100 - N) * self.n // 100), 1)
+        cumulative = np.cumsum(self.group_counts)
+        group = int(np.searchsorted(cumulative, target))
+        below = int(cumulative[group - 1]) if group else 0
+        within = np.cumsum(self.counts[group * GROUP:(group + 1) * GROUP])
+        return group * GROUP + int(np.searchsorted(within, target - below))
+
+    def ln(self, N):
+        """Level exceeded N % of the time, e.g. ln(10) for L10. In dB, NaN if empty"""
+        if self.n == 0:
+            return np.nan
+        return (self.percentile_bin(N) - OFFSET) / 100
+
+    def lns(self, Ns=(10, 50, 90)):
+        """Dict of N -> LN"""
+        return {N: self.ln(N) for N in Ns}
+
+    def minimum(self):
+        return self.ln(100)
+
+    def maximum(self):
+        return self.ln(0)
+
+    def leq(self):
+        """Leq of the levels in the histogram, in dB"""
+        if self.n == 0:
+            return np.nan
+        return level(float(self.counts @ BIN_ENERGY) / self.n)
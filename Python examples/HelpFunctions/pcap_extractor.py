@@ -0,0 +1,539 @@
+# Offline extraction of WebXi messages from pcap and pcapng captures.
+# The capture is read one packet at a time, TCP is reassembled per direction and
+# WebXi messages are found with the same rules as Wireshark/webxi.lua: either sent
+# directly over TCP (the "Socket" connection type) or inside WebSocket frames.
+# Memory use is bounded by the number of open connections, not the capture size.
+#
+#   python -m HelpFunctions.pcap_extractor capture.pcapng            (messages per flow)
+#   python -m HelpFunctions.pcap_extractor capture.pcapng recording  (recording_<flow>.wxc capture files)
+
+import argparse
+import struct
+
+from webxi.webxi_fast_stream import HEADER, MAGIC, EMessageType
+from HelpFunctions.capture_file import StreamRecorder
+
+# Size of the WebXi header and the minimum needed to know the message length (WEBXI_HDR_LEN)
+WEBXI_HDR_LEN = 24
+MESSAGE_TYPES = frozenset(message_type.value for message_type in EMessageType)
+
+# Link types, see https://www.tcpdump.org/linktypes.html
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+IP_PROTOCOL_TCP = 6
+IPV6_EXTENSION_HEADERS = (0, 43, 60)
+
+TCP_FIN, TCP_SYN, TCP_RST = 0x01, 0x02, 0x04
+
+WS_CONTINUATION, WS_TEXT, WS_BINARY = 0, 1, 2
+
+# Bytes held per direction while waiting for missing TCP segments, beyond that the gap is skipped
+MAX_PENDING = 4 * 2 ** 20
+# Largest WebXi message (or WebSocket message) accepted, anything longer is skipped
+MAX_MESSAGE = 64 * 2 ** 20
+# Bytes kept while searching a connection for the first WebXi message
+MAX_SEARCH = 2 ** 16
+
+HTTP_STARTS = (b"HTTP/", b"GET ", b"POST ", b"PUT ", b"DELETE ", b"HEAD ", b"OPTIONS ", b"PATCH ")
+
+
+def is_webxi(data, offset=0):
+    """Same test as is_webxi in webxi.lua: magic, header length, known message type and zero reserved fields"""
+    if len(data) - offset < WEBXI_HDR_LEN:
+        return False
+    magic, header_length, message_type, reserved1, reserved2, _, _ = HEADER.unpack_from(data, offset)
+    return magic == MAGIC and header_length == 16 and message_type in MESSAGE_TYPES and \
+        reserved1 == 0 and reserved2 == 0
+
+
+def message_length(data, offset=0):
+    """Total length of the WebXi message at offset (content_length in bytes 20-23 plus the header)"""
+    return int.from_bytes(data[offset + 20:offset + 24], "little") + WEBXI_HDR_LEN
+
+
+def split_messages(data):
+    """Split a buffer holding WebXi messages after each other, like the loop in webxi.dissector.\n
+       Stops at the first bytes not recognized as a complete WebXi message"""
+    messages, offset = [], 0
+    while is_webxi(data, offset):
+        length = message_length(data, offset)
+        if offset + length > len(data):
+            break
+        messages.append(bytes(data[offset:offset + length]))
+        offset += length
+    return messages
+
+
+# --- Capture files ---
+
+def _pcap_packets(f, header):
+    magic = header[:4]
+    if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1"):
+        endian = "<"
+    elif magic in (b"\xa1\xb2\xc3\xd4", b"\xa1\xb2\x3c\x4d"):
+        endian = ">"
+    else:
+        raise Exception("Not a pcap or pcapng file")
+    resolution = 1e-9 if magic in (b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d") else 1e-6
+    header += f.read(24 - len(header))
+    link_type, = struct.unpack_from(endian + "I", header, 20)
+    record = struct.Struct(endian + "IIII")
+    while True:
+        data = f.read(record.size)
+        if len(data) < record.size:
+            return
+        seconds, fraction, captured_length, original_length = record.unpack(data)
+        data = f.read(captured_length)
+        if len(data) < captured_length:
+            return  # Truncated capture
+        yield seconds + fraction * resolution, link_type, data, captured_length == original_length
+
+
+def _pcapng_resolution(options, endian):
+    """if_tsresol from the options of an Interface Description Block"""
+    offset = 0
+    while offset + 4 <= len(options):
+        code, length = struct.unpack_from(endian + "HH", options, offset)
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            value = options[offset + 4]
+            return 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+        offset += 4 + (length + 3) // 4 * 4
+    return 1e-6
+
+
+def _pcapng_packets(f, header):
+    endian, interfaces = "<", []
+    data = header
+    while True:
+        if len(data) < 8:
+            data += f.read(8 - len(data))
+            if len(data) < 8:
+                return
+        block_type = data[:4]
+        if block_type == b"\x0a\x0d\x0d\x0a":
+            # Section Header Block, sets the byte order of the section
+            data += f.read(12 - len(data))
+            endian = "<" if data[8:12] == b"\x4d\x3c\x2b\x1a" else ">"
+            interfaces = []
+        block_type, block_length = struct.unpack_from(endian + "II", data)
+        if block_length < 12:
+            raise Exception("Corrupt pcapng block")
+        body = data[8:] + f.read(block_length - len(data))
+        if len(body) < block_length - 8:
+            return
+        body = body[:-4]  # Trailing block length
+        data = f.read(8)
+        if block_type == 1:
+            # Interface Description Block
+            link_type, _, _ = struct.unpack_from(endian + "HHI", body)
+            interfaces.append((link_type, _pcapng_resolution(body[8:], endian)))
+        elif block_type == 6:
+            # Enhanced Packet Block
+            interface, high, low, captured_length, original_length = struct.unpack_from(endian + "IIIII", body)
+            link_type, resolution = interfaces[interface]
+            yield ((high << 32) | low) * resolution, link_type, body[20:20 + captured_length], \
+                captured_length == original_length
+        elif block_type == 3:
+            # Simple Packet Block, always on the first interface
+            original_length, = struct.unpack_from(endian + "I", body)
+            link_type, _ = interfaces[0]
+            packet = body[4:4 + original_length]
+            yield None, link_type, packet, len(packet) == original_length
+
+
+def read_packets(path):
+    """Generator of (timestamp, link_type, data, complete) for each packet in a pcap or pcapng file.\n
+       complete is False when the packet was cut to the snap length"""
+    with open(path, "rb") as f:
+        header = f.read(4)
+        if header == b"\x0a\x0d\x0d\x0a":
+            yield from _pcapng_packets(f, header)
+        else:
+            yield from _pcap_packets(f, header)
+
+
+# --- Link, network and transport layers ---
+
+def _ip_packet(link_type, data):
+    """Returns the IP packet inside a link layer frame, or None"""
+    if link_type == LINKTYPE_ETHERNET:
+        ether_type, offset = int.from_bytes(data[12:14], "big"), 14
+        while ether_type in ETHERTYPE_VLAN:
+            ether_type, offset = int.from_bytes(data[offset + 2:offset + 4], "big"), offset + 4
+    elif link_type == LINKTYPE_LINUX_SLL:
+        ether_type, offset = int.from_bytes(data[14:16], "big"), 16
+    elif link_type == LINKTYPE_LINUX_SLL2:
+        ether_type, offset = int.from_bytes(data[0:2], "big"), 20
+    elif link_type in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        family = int.from_bytes(data[0:4], "big" if link_type == LINKTYPE_LOOP else "little")
+        if family > 0xFFFF:
+            family = int.from_bytes(data[0:4], "big")  # NULL written on a host with the other byte order
+        ether_type, offset = (ETHERTYPE_IPV4 if family == 2 else ETHERTYPE_IPV6 if family in (10, 24, 28, 30) else None), 4
+    elif link_type in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        return data
+    else:
+        return None
+    if ether_type not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+        return None
+    return data[offset:]
+
+
+def _tcp_segment(packet):
+    """Returns (source, destination, sequence number, flags, payload) of a TCP segment in an IP packet, or None"""
+    if len(packet) < 20:
+        return None
+    version = packet[0] >> 4
+    if version == 4:
+        header_length = (packet[0] & 0x0F) * 4
+        total_length = int.from_bytes(packet[2:4], "big")
+        if packet[9] != IP_PROTOCOL_TCP or int.from_bytes(packet[6:8], "big") & 0x1FFF:
+            return None  # Not TCP, or not the first IP fragment
+        source, destination = packet[12:16], packet[16:20]
+        end = total_length if total_length else len(packet)  # 0 with TCP segmentation offload
+    elif version == 6:
+        next_header, header_length = packet[6], 40
+        end = 40 + int.from_bytes(packet[4:6], "big")
+        while next_header in IPV6_EXTENSION_HEADERS and header_length + 8 <= len(packet):
+            next_header = packet[header_length]
+            header_length += (packet[header_length + 1] + 1) * 8
+        if next_header != IP_PROTOCOL_TCP:
+            return None
+        source, destination = packet[8:24], packet[24:40]
+    else:
+        return None
+    tcp = packet[header_length:end]
+    if len(tcp) < 20:
+        return None
+    source_port, destination_port, sequence_number = struct.unpack_from(">HHI", tcp)
+    data_offset = (tcp[12] >> 4) * 4
+    return (bytes(source), source_port), (bytes(destination), destination_port), sequence_number, tcp[13], \
+        tcp[data_offset:]
+
+
+# --- Reassembly ---
+
+class _WebxiParser:
+    """Finds WebXi messages in the bytes of one TCP direction.\n
+       States: "search" until the connection is recognized, "http" for HTTP requests
+       and responses (until the WebSocket upgrade), "websocket" and "socket" (WebXi over TCP)"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.state = "search"
+        self.skip = 0
+        self.fragments = bytearray()
+        self.fragments_dropped = False
+
+    def reset(self):
+        """Called on a gap in the TCP stream, the parser searches for the next WebXi message"""
+        self.buffer.clear()
+        self.fragments.clear()
+        self.state = "search"
+        self.skip = 0
+
+    def feed(self, data):
+        """Returns the complete WebXi messages found after adding data"""
+        if self.skip:
+            n = min(self.skip, len(data))
+            self.skip -= n
+            data = data[n:]
+        self.buffer += data
+        messages = []
+        offset, progress = 0, True
+        while progress and not self.skip:
+            state = self.state
+            offset, progress = getattr(self, "_" + state)(offset, messages)
+            progress = progress or self.state != state
+        del self.buffer[:offset]
+        return messages
+
+    def _skip_bytes(self, offset, n):
+        available = len(self.buffer) - offset
+        if n > available:
+            self.skip = n - available
+            return len(self.buffer)
+        return offset + n
+
+    def _search(self, offset, messages):
+        buffer = self.buffer
+        if len(buffer) - offset < 8:
+            return offset, False
+        if buffer.startswith(HTTP_STARTS, offset):
+            self.state = "http"
+            return offset, True
+        # Look for a WebXi header, and a WebSocket frame header in front of it
+        position = buffer.find(MAGIC + b"\x10\x00", offset)
+        while position >= 0:
+            if is_webxi(buffer, position):
+                length = message_length(buffer, position)
+                for frame_start in (position - 2, position - 4, position - 10):
+                    if frame_start >= offset and self._frame_fits(frame_start, position, length):
+                        self.state = "websocket"
+                        return frame_start, True
+                self.state = "socket"
+                return position, True
+            if len(buffer) - position < WEBXI_HDR_LEN:
+                return position, False
+            position = buffer.find(MAGIC + b"\x10\x00", position + 1)
+        # Keep the tail, a header may start in it
+        keep = max(len(buffer) - 3, offset)
+        return keep, keep != offset
+
+    def _frame_fits(self, frame_start, payload_start, length):
+        """True if a WebSocket frame header starting at frame_start has its payload at payload_start,
+           holding at least length bytes"""
+        first, second = self.buffer[frame_start], self.buffer[frame_start + 1]
+        if first & 0x70 or (first & 0x0F) not in (WS_CONTINUATION, WS_BINARY) or second & 0x80:
+            return False
+        header_length = payload_start - frame_start
+        size = second & 0x7F
+        if header_length == 2 and size < 126:
+            return size >= length
+        if header_length == 4 and size == 126:
+            return int.from_bytes(self.buffer[frame_start + 2:frame_start + 4], "big") >= length
+        if header_length == 10 and size == 127:
+            return int.from_bytes(self.buffer[frame_start + 2:frame_start + 10], "big") >= length
+        return False
+
+    def _http(self, offset, messages):
+        buffer = self.buffer
+        if not buffer.startswith(HTTP_STARTS, offset):
+            self.state = "search"
+            return offset, True
+        end = buffer.find(b"\r\n\r\n", offset)
+        if end < 0:
+            if len(buffer) - offset > MAX_SEARCH:
+                self.state = "search"
+                return offset + 1, True
+            return offset, False
+        lines = bytes(buffer[offset:end]).split(b"\r\n")
+        headers = dict((name.strip().lower(), value.strip()) for name, _, value in
+                       (line.partition(b":") for line in lines[1:]))
+        offset = end + 4
+        status = lines[0].split(b" ")
+        switching = status[1] == b"101" if status[0].startswith(b"HTTP/") and len(status) > 1 else \
+            headers.get(b"upgrade", b"").lower() == b"websocket"
+        if switching:
+            # After a 101 response (or a request asking for the upgrade) the connection carries WebSocket frames
+            self.state = "websocket"
+            return offset, True
+        if headers.get(b"transfer-encoding", b"").lower() == b"chunked":
+            # The body length is unknown without parsing the chunks, search for the next message instead
+            self.state = "search"
+            return offset, True
+        return self._skip_bytes(offset, int(headers.get(b"content-length", 0))), True
+
+    def _websocket(self, offset, messages):
+        buffer = self.buffer
+        available = len(buffer) - offset
+        if available < 2:
+            return offset, False
+        first, second = buffer[offset], buffer[offset + 1]
+        header_length, size = 2, second & 0x7F
+        if size == 126:
+            header_length = 4
+        elif size == 127:
+            header_length = 10
+        masked = second & 0x80
+        if masked:
+            header_length += 4
+        if available < header_length:
+            return offset, False
+        if size >= 126:
+            size = int.from_bytes(buffer[offset + 2:offset + 2 + header_length - (6 if masked else 2)], "big")
+        opcode = first & 0x0F
+        start = offset + header_length
+        if opcode not in (WS_CONTINUATION, WS_BINARY) or size > MAX_MESSAGE or \
+                len(self.fragments) + size > MAX_MESSAGE:
+            # Text and control frames, and messages too large to keep
+            if opcode in (WS_CONTINUATION, WS_BINARY):
+                self.fragments.clear()
+                self.fragments_dropped = not first & 0x80
+            return self._skip_bytes(start, size), True
+        if available < header_length + size:
+            return offset, False
+        payload = buffer[start:start + size]
+        if masked:
+            key = (bytes(buffer[start - 4:start]) * (size // 4 + 1))[:size]
+            payload = (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(size, "big")
+        if opcode == WS_BINARY:
+            self.fragments_dropped = False
+            self.fragments[:] = payload
+        elif not self.fragments_dropped:
+            self.fragments += payload
+        if first & 0x80:
+            if not self.fragments_dropped:
+                messages.extend(split_messages(self.fragments))
+            self.fragments.clear()
+            self.fragments_dropped = False
+        return start + size, True
+
+    def _socket(self, offset, messages):
+        buffer = self.buffer
+        if len(buffer) - offset < WEBXI_HDR_LEN:
+            return offset, False
+        if not is_webxi(buffer, offset):
+            self.state = "search"
+            return offset, True
+        length = message_length(buffer, offset)
+        if length > MAX_MESSAGE:
+            return self._skip_bytes(offset, length), True
+        if len(buffer) - offset < length:
+            return offset, False
+        messages.append(bytes(buffer[offset:offset + length]))
+        return offset + length, True
+
+
+class _TcpDirection:
+    """In-order delivery of the bytes sent in one direction of a TCP connection"""
+
+    def __init__(self, sequence_number):
+        self.next = sequence_number
+        self.pending = {}
+        self.pending_bytes = 0
+        self.parser = _WebxiParser()
+
+    def _distance(self, sequence_number):
+        """Signed distance from the next expected sequence number, modulo 2**32"""
+        return ((sequence_number - self.next + 2 ** 31) & 0xFFFFFFFF) - 2 ** 31
+
+    def add(self, sequence_number, payload):
+        """Returns the WebXi messages completed by this segment"""
+        distance = self._distance(sequence_number)
+        if distance > 0:
+            # Out of order, wait for the missing bytes (keeping the longest retransmission)
+            if len(payload) > len(self.pending.get(sequence_number, b"")):
+                self.pending_bytes += len(payload) - len(self.pending.get(sequence_number, b""))
+                self.pending[sequence_number] = bytes(payload)
+            if self.pending_bytes <= MAX_PENDING:
+                return []
+            # Give up on the missing bytes and continue after the gap
+            self.next = min(self.pending, key=self._distance)
+            self.parser.reset()
+            payload, distance = b"", 0
+        messages = []
+        if -distance < len(payload):
+            messages += self.parser.feed(payload[-distance:])
+            self.next = (self.next + len(payload) + distance) & 0xFFFFFFFF
+        while self.pending:
+            ready = [s for s in self.pending if self._distance(s) <= 0]
+            if not ready:
+                break
+            for s in ready:
+                segment = self.pending.pop(s)
+                self.pending_bytes -= len(segment)
+                overlap = -self._distance(s)
+                if overlap < len(segment):
+                    messages += self.parser.feed(segment[overlap:])
+                    self.next = (self.next + len(segment) - overlap) & 0xFFFFFFFF
+        return messages
+
+
+class WebxiExtractor:
+    """Reassembles the TCP connections in a capture and extracts the WebXi messages"""
+
+    def __init__(self):
+        self.connections = {}
+        self.truncated = 0
+
+    def packet(self, link_type, data, complete=True):
+        """Returns a list of (flow, message) for the WebXi messages completed by this packet.\n
+           flow is ((source address, port), (destination address, port))"""
+        packet = _ip_packet(link_type, data)
+        segment = _tcp_segment(packet) if packet is not None else None
+        if segment is None:
+            return []
+        source, destination, sequence_number, flags, payload = segment
+        flow = (source, destination)
+        if flags & TCP_RST:
+            self.connections.pop(flow, None)
+            self.connections.pop((destination, source), None)
+            return []
+        if not complete:
+            # Like the Lua dissector, sliced packets are not reassembled, the stream is resynchronized
+            self.truncated += 1
+            direction = self.connections.get(flow)
+            if direction is not None:
+                direction.next = (sequence_number + len(payload)) & 0xFFFFFFFF
+                direction.parser.reset()
+            return []
+        if flags & TCP_SYN:
+            self.connections[flow] = _TcpDirection((sequence_number + 1) & 0xFFFFFFFF)
+            return []
+        direction = self.connections.get(flow)
+        if direction is None:
+            if not payload:
+                return []
+            # Connection established before the capture started
+            direction = self.connections[flow] = _TcpDirection(sequence_number)
+        messages = direction.add(sequence_number, payload) if payload else []
+        if flags & TCP_FIN and not direction.pending:
+            del self.connections[flow]
+        return [(flow, message) for message in messages]
+
+    def extract(self, path):
+        """Generator of (timestamp, flow, message) for each WebXi message in a pcap or pcapng file"""
+        for timestamp, link_type, data, complete in read_packets(path):
+            for flow, message in self.packet(link_type, data, complete):
+                yield timestamp, flow, message
+
+
+def extract(path):
+    """Generator of (timestamp, flow, message) for each WebXi message in a pcap or pcapng file"""
+    return WebxiExtractor().extract(path)
+
+
+def flow_name(flow):
+    """Readable name of a flow, e.g. 192.168.1.10_80-192.168.1.2_50712"""
+    def endpoint(address, port):
+        if len(address) == 4:
+            return "%s_%d" % (".".join(str(b) for b in address), port)
+        return "%s_%d" % (address.hex(), port)
+    return "%s-%s" % (endpoint(*flow[0]), endpoint(*flow[1]))
+
+
+def extract_to_captures(path, prefix):
+    """Write the WebXi messages of each flow in a pcap/pcapng file to the capture file prefix_<flow>.wxc.\n
+       Returns a dict of flow -> number of messages"""
+    recorders, counts = {}, {}
+    try:
+        for _, flow, message in extract(path):
+            if flow not in recorders:
+                recorders[flow] = StreamRecorder("%s_%s.wxc" % (prefix, flow_name(flow)))
+                counts[flow] = 0
+            recorders[flow].record(message)
+            counts[flow] += 1
+    finally:
+        for recorder in recorders.values():
+            recorder.close()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract WebXi messages from a pcap/pcapng capture")
+    parser.add_argument("capture", help="pcap or pcapng file")
+    parser.add_argument("prefix", nargs="?", help="Write each flow to the capture file <prefix>_<flow>.wxc")
+    args = parser.parse_args()
+    if args.prefix is None:
+        counts = {}
+        for _, flow, message in extract(args.capture):
+            message_type = int.from_bytes(message[4:6], "little")
+            counts.setdefault(flow, {}).setdefault(EMessageType(message_type).name, 0)
+            counts[flow][EMessageType(message_type).name] += 1
+        for flow, types in counts.items():
+            print(flow_name(flow), types)
+    else:
+        for flow, count in extract_to_captures(args.capture, args.prefix).items():
+            print("%s: %d messages" % (flow_name(flow), count))
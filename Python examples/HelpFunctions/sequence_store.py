@@ -0,0 +1,167 @@
+# In-memory store of the decoded values of streamed sequences.
+# Every value is kept with the header time of the message it arrived in, in columns
+# per sequence_id. The store is a packetHandler, so one store can be fed by a stream
+# (or a replayed capture) and read by all consumers in the process:
+#
+#   store = SequenceStore()
+#   store.add_sequence(ID, sequence)                  # sequence from seq.get_sequence
+#   await webSocket.next_async_websocket(uri, store)
+#   times, values = store[ID].range_seconds(t0, t1)
+
+import bisect
+import numpy as np
+
+import webxi.webxi_fast_stream as webxiFast
+import webxi.webxi_batch as webxiBatch
+from webxi.webxi_fast_stream import EMessageType, EMessageFormat
+from webxi.webxi_encoder import to_ticks
+import HelpFunctions.stream_handler as stream
+
+class SequenceColumn:
+    """Time stamped values of one sequence, stored in preallocated chunks.\n
+       A full chunk is never copied or reallocated, a new chunk is added instead.
+       Times are WebXi header times (ticks of 2**-32 s since 1970) and must not decrease"""
+
+    def __init__(self, vector_length=None, dtype=np.float64, chunk_size=4096):
+        self.shape = () if vector_length is None else (vector_length,)
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.times = []         # One array per chunk
+        self.values = []
+        self.starts = []        # First time of each chunk, searched with bisect
+        self.used = chunk_size  # Entries used in the last chunk
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def _new_chunk(self, time):
+        self.times.append(np.empty(self.chunk_size, np.uint64))
+        self.values.append(np.empty((self.chunk_size,) + self.shape, self.dtype))
+        self.starts.append(time)
+        self.used = 0
+
+    def append(self, time, value):
+        if self.used == self.chunk_size:
+            self._new_chunk(time)
+        self.times[-1][self.used] = time
+        self.values[-1][self.used] = value
+        self.used += 1
+        self.length += 1
+
+    def extend(self, times, values):
+        """Append many values at once, values has one row per time"""
+        done = 0
+        while done < len(times):
+            if self.used == self.chunk_size:
+                self._new_chunk(int(times[done]))
+            n = min(len(times) - done, self.chunk_size - self.used)
+            self.times[-1][self.used:self.used + n] = times[done:done + n]
+            self.values[-1][self.used:self.used + n] = values[done:done + n]
+            self.used += n
+            self.length += n
+            done += n
+
+    def position(self, time):
+        """Index of the first value with a time >= time, O(log n)"""
+        # Only the chunk before the first chunk starting at or after time can hold the position
+        chunk = bisect.bisect_left(self.starts, time) - 1
+        if chunk < 0:
+            return 0
+        used = self.used if chunk == len(self.times) - 1 else self.chunk_size
+        return chunk * self.chunk_size + int(np.searchsorted(self.times[chunk][:used], time))
+
+    def slice(self, start, stop):
+        """Returns (times, values) for the indexes start to stop.\n
+           Views of the store if they are in one chunk, else a copy"""
+        start, stop = max(start, 0), min(stop, self.length)
+        if stop <= start:
+            return np.empty(0, np.uint64), np.empty((0,) + self.shape, self.dtype)
+        first, last = start // self.chunk_size, (stop - 1) // self.chunk_size
+        if first == last:
+            offset = first * self.chunk_size
+            return self.times[first][start - offset:stop - offset], self.values[first][start - offset:stop - offset]
+        times, values = [], []
+        for chunk in range(first, last + 1):
+            offset = chunk * self.chunk_size
+            begin, end = max(start - offset, 0), min(stop - offset, self.chunk_size)
+            times.append(self.times[chunk][begin:end])
+            values.append(self.values[chunk][begin:end])
+        return np.concatenate(times), np.concatenate(values)
+
+    def range(self, t0, t1):
+        """Returns (times, values) with t0 <= time < t1 (header times)"""
+        return self.slice(self.position(t0), self.position(t1))
+
+    def range_seconds(self, t0, t1):
+        """Same as range, with times in seconds since 1970"""
+        return self.range(to_ticks(t0), to_ticks(t1))
+
+    def last(self, n=1):
+        """Returns (times, values) of the n newest values"""
+        return self.slice(self.length - n, self.length)
+
+    def get(self):
+        """Returns (times, values) of all values"""
+        return self.slice(0, self.length)
+
+
+class SequenceStore:
+    """Columns of time stamped values indexed by sequence_id, filled from raw SequenceData messages.\n
+       Only sequences added with add_sequence are stored. The store can be used directly as packetHandler"""
+
+    def __init__(self, chunk_size=4096):
+        self.chunk_size = chunk_size
+        self.columns = {}
+        self.conversions = {}
+
+    def add_sequence(self, sequence_id, sequence, scaled=True):
+        """Store the values of sequence_id. sequence is the sequence metadata, as returned by
+           seq.get_sequence, with its DataType and VectorLength. scaled=True stores levels in dB"""
+        data_type = stream.get_data_type(sequence["DataType"])
+        vector_length = sequence.get("VectorLength")
+        dtype = data_type.dtype if data_type.field is None else data_type.dtype[data_type.field]
+        if scaled and data_type.divisor is not None:
+            dtype = np.float64
+        self.conversions[sequence_id] = (data_type, vector_length, scaled)
+        self.columns[sequence_id] = SequenceColumn(vector_length, dtype, self.chunk_size)
+        return self.columns[sequence_id]
+
+    def __getitem__(self, sequence_id):
+        return self.columns[sequence_id]
+
+    def __contains__(self, sequence_id):
+        return sequence_id in self.columns
+
+    def __call__(self, message):
+        self.add_message(message)
+
+    def add_message(self, message):
+        """Store the values of one WebSocket message"""
+        header = webxiFast.Header(message)
+        if header.message_type != EMessageType.e_sequence_data:
+            return
+        content = memoryview(message)[webxiFast.HEADER.size:webxiFast.HEADER.size + header.content_length]
+        sequence_data = webxiFast.decode_sequence_data(content)
+        if sequence_data.message_format != EMessageFormat.raw:
+            return
+        for block in sequence_data.sequence_blocks:
+            if block.sequence_id in self.conversions:
+                data_type, vector_length, scaled = self.conversions[block.sequence_id]
+                values = data_type.convert(block.values, scaled)
+                self.columns[block.sequence_id].append(header.time, values[0] if vector_length is None else
+                                                       values[:vector_length])
+
+    def add_messages(self, messages):
+        """Store the values of many messages, decoded column-wise with webxi_batch.decode_batch"""
+        batch = webxiBatch.decode_batch(messages)
+        for sequence_id, (data_type, vector_length, scaled) in self.conversions.items():
+            times, raw = batch.values("u1", sequence_id)
+            if len(times) == 0:
+                continue
+            values = data_type.convert(np.ascontiguousarray(raw), scaled).reshape(len(times), -1)
+            self.columns[sequence_id].extend(times, values[:, 0] if vector_length is None else
+                                             values[:, :vector_length])
+
+# Store shared by the modules of a process
+DataStore = SequenceStore()
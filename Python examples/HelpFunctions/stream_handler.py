@@ -1,3 +1,4 @@
+import numpy as np
 import requests
 from requests.auth import HTTPDigestAuth
 
@@ -26,17 +27,64 @@ def get_stream_ID(host, streamName):
     for count, subtree in enumerate(streams.values(), 1): # Start at 1 as the stream count does this
         if subtree["Name"] == streamName: return count
 
-def data_type_conv(data_type, value, vector_length):
-    """Convert the byte data retrived from BK2245 to Int16 format\n
-       The byte format is in 'little'"""
-    if data_type == "Int16":
-        if vector_length == None:
-            return int.from_bytes(value, "little", signed=True)
-        else:
-            value_array = []
-            for i in range(0, vector_length*2, 2):
-                value_array.append(int.from_bytes(value[i:i+2], "little", signed=True))
-            # print(len(value_array))
-            return value_array
-    elif data_type == "BKTimeSpan":
-        return int.from_bytes(value[-4:], "little", signed=True)
\ No newline at end of file
+class DataType:
+    """Describes how values of a sequence DataType are stored in the stream.\n
+       field picks one field of a structured dtype, and divisor scales the raw
+       values to their unit, e.g. 100 for levels in 0.01 dB"""
+    def __init__(self, dtype, field=None, divisor=None):
+        self.dtype = np.dtype(dtype)
+        self.field = field
+        self.divisor = divisor
+
+    def convert(self, buffer, scaled=False):
+        values = np.frombuffer(buffer, dtype=self.dtype)
+        if self.field is not None:
+            values = values[self.field]
+        if scaled and self.divisor is not None:
+            values = values / self.divisor
+        return values
+
+# Registry of the sequence metadata DataTypes, see "5.2.5 DataType" in the WebXi protocol specification
+DATA_TYPES = {}
+
+def register_data_type(name, dtype, field=None, divisor=None):
+    """Add or replace the conversion used for the sequence metadata DataType name"""
+    DATA_TYPES[name] = DataType(dtype, field, divisor)
+
+register_data_type("Int8", "i1")
+register_data_type("Uint8", "u1")
+register_data_type("Int16", "<i2", divisor=100) # Levels in 0.01 dB
+register_data_type("Uint16", "<u2")
+register_data_type("Int32", "<i4")
+register_data_type("Uint32", "<u4")
+register_data_type("Int64", "<i8")
+register_data_type("Uint64", "<u8")
+register_data_type("Float", "<f4")
+register_data_type("Double", "<f8")
+register_data_type("Complex32", "<c8")
+register_data_type("Complex64", "<c16")
+register_data_type("BKTimeSpan", [("fraction", "<u4"), ("seconds", "<i4")], field="seconds")
+
+def get_data_type(data_type):
+    if data_type not in DATA_TYPES:
+        raise Exception("Unsupported data type: " + str(data_type))
+    return DATA_TYPES[data_type]
+
+def data_type_conv(data_type, value, vector_length, scaled=False):
+    """Convert the byte data retrived from BK2245 using the DataType of the sequence\n
+       The byte format is in 'little'. Returns a single value if vector_length is None,
+       otherwise a NumPy array. With scaled=True Int16 levels are returned in dB.
+       Raises an exception for a DataType that is not registered"""
+    values = get_data_type(data_type).convert(bytes(value) if isinstance(value, list) else value, scaled)
+    if vector_length == None:
+        return values[0].item()
+    return values[:vector_length]
+
+def data_type_conv_blocks(data_type, blocks, vector_length, scaled=False):
+    """Convert the values of many sequence blocks in one call, e.g. package.content.sequence_blocks\n
+       Returns an array with one row per block (1-D if vector_length is None)"""
+    buffer = b"".join(bytes(block.values) if isinstance(block.values, list) else block.values for block in blocks)
+    values = get_data_type(data_type).convert(buffer, scaled)
+    if vector_length == None:
+        return values
+    return values.reshape(len(blocks), -1)[:, :vector_length]
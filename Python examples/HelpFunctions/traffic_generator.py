@@ -0,0 +1,142 @@
+import asyncio
+import time as clock
+import numpy as np
+
+import webxi.webxi_encoder as webxiEncoder
+from webxi.webxi_fast_stream import EMessageFormat
+
+# CRC tables used in FLAC frames, CRC-8 (poly 0x07) for the frame header and CRC-16 (poly 0x8005) for the frame
+def _crc_table(bits, poly):
+    top = 1 << (bits - 1)
+    mask = (1 << bits) - 1
+    table = []
+    for i in range(256):
+        crc = i << (bits - 8)
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) & mask if crc & top else (crc << 1) & mask
+        table.append(crc)
+    return table
+
+CRC8_TABLE = _crc_table(8, 0x07)
+CRC16_TABLE = _crc_table(16, 0x8005)
+
+def crc8(data):
+    crc = 0
+    for b in data:
+        crc = CRC8_TABLE[crc ^ b]
+    return crc
+
+def crc16(data):
+    crc = 0
+    for b in data:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC16_TABLE[(crc >> 8) ^ b]
+    return crc
+
+def _utf8_number(n):
+    """FLAC codes the frame number like an (extended) UTF-8 character"""
+    if n < 0x80:
+        return bytes((n,))
+    length = 2
+    while n >= 1 << (5 * length + 1):
+        length += 1
+    out = [0x80 | ((n >> (6 * i)) & 0x3F) for i in range(length - 1)]
+    first = ((0xFF << (8 - length)) & 0xFF) | (n >> (6 * (length - 1)))
+    return bytes([first] + out[::-1])
+
+def flac_frame(samples, frame_number):
+    """Encode 24-bit mono samples as one FLAC frame with a VERBATIM subframe.\n
+       The frame decodes with the STREAMINFO header from flac_stream_2_samples.streaminfo_header"""
+    header = bytearray(b"\xFF\xF8")     # Sync code, fixed block size
+    header.append(0x70)                 # 16-bit block size at end of header, sample rate from STREAMINFO
+    header.append(0x0C)                 # Mono, 24 bits per sample
+    header += _utf8_number(frame_number)
+    header += (len(samples) - 1).to_bytes(2, "big")
+    header.append(crc8(header))
+    # Subframe header (VERBATIM) followed by the samples as 24-bit big endian
+    payload = np.asarray(samples, dtype=">i4").view(np.uint8).reshape(-1, 4)[:, 1:].tobytes()
+    frame = bytes(header) + b"\x02" + payload
+    return frame + crc16(frame).to_bytes(2, "big")
+
+def silent_mp3_frame():
+    """One MPEG-1 Layer III frame (32 kHz, 32 kbit/s, mono) decoding to 1152 samples of silence"""
+    return b"\xFF\xFB\x18\xC0" + bytes(140)
+
+class TrafficGenerator:
+    """Generates realistic SequenceData messages without a device.\n
+       Raw sequences hold Int16 levels in 0.01 dB (vector_length bands if given) and
+       are sent rate times per second. FLAC sequences hold a 1 kHz tone in noise at
+       sample_rate, sent in frames of block_size samples. MP3 sequences hold silence"""
+
+    def __init__(self, number_of_sequences=1, vector_length=None, rate=10, message_format=EMessageFormat.raw,
+                 sequence_ids=None, start_time=None, sample_rate=2**16, block_size=4096, seed=None):
+        self.sequence_ids = list(range(1, number_of_sequences + 1)) if sequence_ids is None else list(sequence_ids)
+        self.vector_length = vector_length
+        self.message_format = message_format
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        if message_format == EMessageFormat.raw:
+            self.rate = rate
+        elif message_format == EMessageFormat.flac:
+            self.rate = sample_rate / block_size
+        else:
+            self.rate = 32e3 / 1152
+        self.start_time = clock.time() if start_time is None else start_time
+        self.rng = np.random.default_rng(seed)
+        self.count = 0
+        # Level of each sequence (and band) in dB, following a random walk
+        bands = 1 if vector_length is None else vector_length
+        self.levels = 55 + self.rng.normal(0, 3, (len(self.sequence_ids), bands))
+        if vector_length is not None:
+            self.levels -= np.linspace(0, 20, bands)
+
+    @property
+    def time(self):
+        """Header time of the next message"""
+        return webxiEncoder.to_ticks(self.start_time + self.count / self.rate)
+
+    def _raw_blocks(self):
+        self.levels = np.clip(self.levels + self.rng.normal(0, 0.5, self.levels.shape), 20, 130)
+        values = np.round(self.levels * 100).astype("<i2")
+        return [(sequence_id, values[i].tobytes()) for i, sequence_id in enumerate(self.sequence_ids)]
+
+    def _flac_blocks(self):
+        n = np.arange(self.count * self.block_size, (self.count + 1) * self.block_size)
+        blocks = []
+        for sequence_id in self.sequence_ids:
+            signal = 0.3 * np.sin(2 * np.pi * 1000 * n / self.sample_rate) + self.rng.normal(0, 0.01, len(n))
+            samples = np.round(signal * (2 ** 23 - 1)).astype(np.int32)
+            blocks.append(([sequence_id], flac_frame(samples, self.count)))
+        return blocks
+
+    def next_blocks(self):
+        """Returns the blocks of the next message, as accepted by webxi_encoder.encode_sequence_data"""
+        if self.message_format == EMessageFormat.raw:
+            blocks = self._raw_blocks()
+        elif self.message_format == EMessageFormat.flac:
+            blocks = self._flac_blocks()
+        else:
+            blocks = [([sequence_id], silent_mp3_frame()) for sequence_id in self.sequence_ids]
+        self.count += 1
+        return blocks
+
+    def next_message(self):
+        """Returns the next message as bytes"""
+        time = self.time
+        return webxiEncoder.encode_sequence_data(self.next_blocks(), self.message_format, time)
+
+    def messages(self, count=None):
+        """Generator of count messages (endless if count is None)"""
+        while count is None or count > 0:
+            yield self.next_message()
+            if count is not None:
+                count -= 1
+
+    async def run(self, packetHandler, count=None, speed=1):
+        """Calls packetHandler with each message, paced at speed times the real rate.\n
+           Same calling convention as websocket_handler.next_async_websocket"""
+        t0 = clock.monotonic()
+        first = self.count
+        for message in self.messages(count):
+            packetHandler(message)
+            delay = t0 + (self.count - first) / (self.rate * speed) - clock.monotonic()
+            await asyncio.sleep(max(delay, 0))
@@ -0,0 +1,77 @@
+import math
+
+import numpy as np
+import pytest
+
+from HelpFunctions.Leq import MovingLeq, MultiWindowLeq, VectorMultiWindowLeq, moving_leq
+
+
+def levels_with_gaps(count=300, seed=0):
+    levels = np.random.default_rng(seed).uniform(30, 90, count)
+    levels[[50, 51, 120, count - 43]] = np.nan
+    return levels
+
+
+def exact_leq(levels):
+    """Leq of levels from an exactly rounded sum of the energies, NaN if a level is NaN"""
+    if np.isnan(levels).any():
+        return np.nan
+    return 10 * math.log10(math.fsum(10 ** (levels / 10)) / len(levels))
+
+
+@pytest.mark.parametrize("window_length, resum_interval", [(10, 25), (10, 10), (10, 4), (7, 3), (7, 1), (5, 100)])
+def test_incremental_matches_full_sum(window_length, resum_interval):
+    levels = levels_with_gaps(200)
+    full = MovingLeq(window_length)
+    incremental = MovingLeq(window_length, incremental=True, resum_interval=resum_interval)
+    for value in levels:
+        np.testing.assert_allclose(incremental.move(value), full.move(value), rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize("window_length", range(1, 65))
+def test_moving_leq_matches_moving_leq_class(window_length):
+    levels = levels_with_gaps()
+    window = MovingLeq(window_length)
+    expected = np.array([window.move(value) for value in levels])
+    # Whole array in one chunk, and chunks shorter than the window
+    for chunk_size in (2**22, max(window_length // 2, 1), 1):
+        np.testing.assert_allclose(moving_leq(levels, window_length, chunk_size=chunk_size), expected,
+                                   rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize("window_length", [1, 7, 16, 64])
+def test_moving_leq_of_bands(window_length):
+    bands = np.stack([levels_with_gaps(seed=seed) for seed in range(3)], axis=1)
+    result = moving_leq(bands, window_length, chunk_size=5)
+    for band in range(bands.shape[1]):
+        np.testing.assert_allclose(result[:, band], moving_leq(bands[:, band], window_length), rtol=0, atol=1e-9)
+
+
+def loud_and_quiet_levels(count=2000, seed=1):
+    # Loud values far above the quiet ones test the precision of the cumulative sums
+    rng = np.random.default_rng(seed)
+    levels = rng.uniform(10, 40, count)
+    levels[rng.integers(0, count, 20)] = 140
+    levels[[300, 301, count - 100]] = np.nan
+    return levels
+
+
+@pytest.mark.parametrize("window_lengths", [[1, 10, 60], [7, 100, 600]])
+def test_multi_window_leq_precision(window_lengths):
+    levels = loud_and_quiet_levels()
+    windows = MultiWindowLeq(window_lengths)
+    for k, value in enumerate(levels, 1):
+        leqs = windows.move(value)
+        for length in window_lengths:
+            np.testing.assert_allclose(leqs[length], exact_leq(levels[max(k - length, 0):k]), rtol=0, atol=1e-13)
+
+
+def test_vector_multi_window_leq_precision():
+    window_lengths = [1, 10, 60]
+    bands = np.stack([loud_and_quiet_levels(600, seed) for seed in range(3)], axis=1)
+    windows = VectorMultiWindowLeq(window_lengths, bands.shape[1])
+    for k, values in enumerate(bands, 1):
+        leqs = windows.move(values)
+        for length in window_lengths:
+            expected = [exact_leq(bands[max(k - length, 0):k, band]) for band in range(bands.shape[1])]
+            np.testing.assert_allclose(leqs[length], expected, rtol=0, atol=1e-13)
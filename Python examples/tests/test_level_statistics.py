@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from HelpFunctions.level_statistics import LevelHistogram
+
+NS = [0, 1, 5, 10, 30, 50, 70, 90, 95, 99, 100]
+
+
+def expected_ln(values, N):
+    return np.percentile(values, 100 - N, method="inverted_cdf")
+
+
+def test_ln_of_1_to_10():
+    histogram = LevelHistogram()
+    histogram.add_array(np.arange(1, 11.0))
+    assert histogram.ln(70) == 3.0
+    for N in NS:
+        assert histogram.ln(N) == expected_ln(np.arange(1, 11.0), N)
+
+
+@pytest.mark.parametrize("count", [1, 7, 10, 101, 1000])
+def test_add_and_add_array(count):
+    values = np.round(np.random.default_rng(count).uniform(30, 90, count), 2)
+    added, added_array = LevelHistogram(), LevelHistogram()
+    for value in values:
+        added.add(value)
+    added_array.add_array(values)
+    for N in NS:
+        assert added.ln(N) == expected_ln(values, N)
+        assert added_array.ln(N) == expected_ln(values, N)
+
+
+@pytest.mark.parametrize("window_length", [1, 10, 37])
+def test_sliding_window(window_length):
+    values = np.round(np.random.default_rng(window_length).uniform(30, 90, 200), 2)
+    histogram = LevelHistogram(window_length=window_length)
+    for k, value in enumerate(values, 1):
+        histogram.add(value)
+        window = values[max(k - window_length, 0):k]
+        for N in NS:
+            assert histogram.ln(N) == expected_ln(window, N)
+    batched = LevelHistogram(window_length=window_length)
+    for start in range(0, len(values), 15):
+        stop = min(start + 15, len(values))
+        batched.add_array(values[start:stop])
+        window = values[max(stop - window_length, 0):stop]
+        for N in NS:
+            assert batched.ln(N) == expected_ln(window, N)
@@ -1,5 +1,8 @@
 from .webxi_header import *
 from .webxi_stream import *
+from .webxi_fast_stream import *
+from .webxi_batch import *
+from .webxi_encoder import *
 
 #from .openapi_header import *
 #from .openapi_stream import *
\ No newline at end of file
@@ -0,0 +1,153 @@
+# Hand written NumPy decoders for raw SequenceData and AuxSequenceData messages.
+# Instead of building Kaitai objects per message/value, the headers, blocks and
+# values are decoded column-wise with NumPy. decode_batch is intended for offline
+# replay and catching up on a backlog of messages.
+
+import numpy as np
+import kaitaistruct
+
+from .webxi_fast_stream import MAGIC, EMessageType, EMessageFormat
+
+HEADER_DTYPE = np.dtype([("magic", "<u2"), ("header_length", "<u2"), ("message_type", "<u2"),
+                         ("content_version", "<u2"), ("reserved2", "<u4"), ("time", "<u8"),
+                         ("content_length", "<u4")])
+SEQUENCE_DATA_DTYPE = np.dtype([("number_of_blocks", "<u2"), ("message_format", "u1"), ("reserved", "u1")])
+RAW_BLOCK_DTYPE = np.dtype([("sequence_id", "<u2"), ("value_length", "<u4")])
+AUX_SEQUENCE_DATA_DTYPE = np.dtype([("number_of_sequences", "<u2"), ("reserved", "<u2")])
+AUX_BLOCK_DTYPE = np.dtype([("sequence_id", "<u2"), ("number_of_values", "<u2")])
+# relative_time followed by a value whose lower 24 bits hold a signed integer (see calc_value in the .ksy)
+AUX_VALUE_DTYPE = np.dtype([("relative_time", "<u4"), ("value", "<i4")])
+
+
+def _gather(buffer, offsets, dtype):
+    """Read one dtype record at each byte offset in buffer"""
+    index = offsets[:, None] + np.arange(dtype.itemsize)
+    return buffer[index].view(dtype)[:, 0]
+
+
+class SequenceDataBatch:
+    """Columns describing the raw SequenceData blocks of many messages.\n
+       One row per block, ordered as the blocks were received:
+       message (index of the message in the batch), time (header time),
+       sequence_id, offset (byte offset of the values in buffer) and length (bytes)"""
+
+    def __init__(self, buffer, message, time, sequence_id, offset, length):
+        self.buffer = buffer
+        self.message = message
+        self.time = time
+        self.sequence_id = sequence_id
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return len(self.sequence_id)
+
+    def select(self, sequence_id):
+        """Returns a batch with only the blocks from sequence_id"""
+        mask = self.sequence_id == sequence_id
+        return SequenceDataBatch(self.buffer, self.message[mask], self.time[mask], self.sequence_id[mask],
+                                 self.offset[mask], self.length[mask])
+
+    def values(self, dtype, sequence_id=None):
+        """Decode the block values as dtype, e.g. '<i2' for Int16.\n
+           Returns (time, values) where values has one row per block, or is 1-D
+           if each block holds a single value. All selected blocks must have the same length"""
+        batch = self if sequence_id is None else self.select(sequence_id)
+        dtype = np.dtype(dtype)
+        if len(batch) == 0:
+            return batch.time, np.empty(0, dtype)
+        length = int(batch.length[0])
+        if np.any(batch.length != length):
+            raise ValueError("Blocks have different lengths, select a single sequence_id")
+        if length % dtype.itemsize:
+            raise ValueError("Block length %d is not a multiple of %s" % (length, dtype))
+        values = self.buffer[batch.offset[:, None] + np.arange(length)].view(dtype)
+        if values.shape[1] == 1:
+            values = values[:, 0]
+        return batch.time, values
+
+
+def decode_batch(messages):
+    """Decode the raw SequenceData blocks of a list of WebSocket messages into a SequenceDataBatch.\n
+       Other message types and FLAC/MP3 messages are skipped"""
+    lengths = np.fromiter((len(message) for message in messages), dtype=np.int64, count=len(messages))
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    buffer = np.frombuffer(b"".join(messages), dtype=np.uint8)
+
+    if np.any(lengths < HEADER_DTYPE.itemsize):
+        raise EOFError("Message shorter than the WebXi header")
+    headers = _gather(buffer, starts, HEADER_DTYPE)
+    bad = np.flatnonzero(headers["magic"] != int.from_bytes(MAGIC, "little"))
+    if len(bad):
+        magic = headers["magic"][bad[0]].tobytes()
+        raise kaitaistruct.ValidationNotEqualError(MAGIC, magic, None, u"/types/header/seq/0")
+    content_starts = starts + HEADER_DTYPE.itemsize
+    if np.any(content_starts + headers["content_length"] > ends):
+        raise EOFError("Message shorter than its content_length")
+
+    message = np.flatnonzero(headers["message_type"] == EMessageType.e_sequence_data.value)
+    sequence_data = _gather(buffer, content_starts[message], SEQUENCE_DATA_DTYPE)
+    raw = sequence_data["message_format"] == EMessageFormat.raw.value
+    message = message[raw]
+    number_of_blocks = sequence_data["number_of_blocks"][raw]
+    position = content_starts[message] + SEQUENCE_DATA_DTYPE.itemsize
+
+    # Blocks are read one block index at a time, for all messages that have that many blocks
+    columns = []
+    for k in range(int(number_of_blocks.max(initial=0))):
+        active = number_of_blocks > k
+        message, number_of_blocks, position = message[active], number_of_blocks[active], position[active]
+        blocks = _gather(buffer, position, RAW_BLOCK_DTYPE)
+        offset = position + RAW_BLOCK_DTYPE.itemsize
+        length = blocks["value_length"].astype(np.int64)
+        if np.any(offset + length > ends[message]):
+            raise EOFError("Block extends beyond the end of its message")
+        columns.append((message, blocks["sequence_id"], offset, length))
+        position = offset + length
+
+    if columns:
+        message, sequence_id, offset, length = (np.concatenate(column) for column in zip(*columns))
+        order = np.argsort(message, kind="stable")
+        message, sequence_id, offset, length = message[order], sequence_id[order], offset[order], length[order]
+    else:
+        message = offset = length = np.empty(0, np.int64)
+        sequence_id = np.empty(0, np.uint16)
+    return SequenceDataBatch(buffer, message, headers["time"][message], sequence_id, offset, length)
+
+
+def decode_aux_blocks(content, offset=0):
+    """Decode the content of an AuxSequenceData message into a list of (sequence_id, values),
+       one per block as sent. values is a structured array with the fields relative_time and value,
+       value is the sign extended 24-bit value, the same as AuxValue.values.calc_value"""
+    content = np.frombuffer(content, dtype=np.uint8)
+    header = content[offset:offset + AUX_SEQUENCE_DATA_DTYPE.itemsize].view(AUX_SEQUENCE_DATA_DTYPE)[0]
+    offset += AUX_SEQUENCE_DATA_DTYPE.itemsize
+    blocks = []
+    for _ in range(int(header["number_of_sequences"])):
+        block = content[offset:offset + AUX_BLOCK_DTYPE.itemsize].view(AUX_BLOCK_DTYPE)[0]
+        offset += AUX_BLOCK_DTYPE.itemsize
+        end = offset + int(block["number_of_values"]) * AUX_VALUE_DTYPE.itemsize
+        if end > len(content):
+            raise EOFError("requested %s bytes, but only %s bytes available" % (end, len(content)))
+        values = content[offset:end].view(AUX_VALUE_DTYPE).copy()
+        # Drop the 4th byte and sign extend from bit 23
+        values["value"] = (values["value"] << 8) >> 8
+        blocks.append((int(block["sequence_id"]), values))
+        offset = end
+    return blocks
+
+
+def merge_aux_blocks(blocks):
+    """dict of sequence_id -> values of the (sequence_id, values) blocks, in the order received"""
+    sequences = {}
+    for sequence_id, values in blocks:
+        sequences[sequence_id] = np.concatenate((sequences[sequence_id], values)) if sequence_id in sequences else values
+    return sequences
+
+
+def decode_aux_sequence_data(content, offset=0):
+    """Decode the content of an AuxSequenceData message into a dict of
+       sequence_id -> structured array with the fields relative_time and value.\n
+       value is the sign extended 24-bit value, the same as AuxValue.values.calc_value"""
+    return merge_aux_blocks(decode_aux_blocks(content, offset))
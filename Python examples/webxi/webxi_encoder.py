@@ -0,0 +1,120 @@
+# Hand written encoder for the messages described in webxi-stream.ksy.
+# The output of each encode function parses with WebxiStream.from_bytes and
+# WebxiFastStream.from_bytes, which makes it possible to test and benchmark the
+# decoders without a 2245/2255.
+
+import struct
+from enum import Enum
+
+from .webxi_fast_stream import HEADER, SEQUENCE_DATA, RAW_BLOCK, U4, MAGIC, EMessageType, EMessageFormat
+
+# "The length of the rest of the header up to but not including ContentLength", see the protocol specification
+HEADER_LENGTH = 16
+# WebXi times are counted in ticks of 2**-32 seconds since 1970 (TimeFamily 536870912)
+TICKS_PER_SECOND = 2 ** 32
+
+U2U2 = struct.Struct("<HH")
+STATUS = struct.Struct("<HHHHii")
+QUALITY_BLOCK = struct.Struct("<HHI")
+AUX_VALUE = struct.Struct("<Ii")
+
+
+def _value(enum_or_int):
+    return enum_or_int.value if isinstance(enum_or_int, Enum) else enum_or_int
+
+
+def _string(text):
+    data = text.encode("utf-8")
+    return U4.pack(len(data)) + data
+
+
+def to_ticks(seconds):
+    """Convert a time in seconds since 1970 (e.g. time.time()) to a WebXi header time"""
+    return int(round(seconds * TICKS_PER_SECOND))
+
+
+def encode_message(message_type, content, time=0, content_version=0):
+    """Put a header in front of an encoded content.\n
+       Devices send content_version 0, which the Wireshark dissector requires"""
+    return HEADER.pack(MAGIC, HEADER_LENGTH, _value(message_type), content_version, 0, time, len(content)) + content
+
+
+def encode_sequence_data(blocks, message_format=EMessageFormat.raw, time=0):
+    """Encode a SequenceData message.\n
+       For the raw format blocks is a list of (sequence_id, values), for mp3 and flac
+       a list of (sequence_ids, frame). values and frame are bytes-like"""
+    message_format = _value(message_format)
+    parts = [SEQUENCE_DATA.pack(len(blocks), message_format, 0)]
+    if message_format == EMessageFormat.raw.value:
+        for sequence_id, values in blocks:
+            parts.append(RAW_BLOCK.pack(sequence_id, len(values)))
+            parts.append(values)
+    else:
+        for sequence_ids, frame in blocks:
+            parts.append(struct.pack("<H%dH" % len(sequence_ids), len(sequence_ids), *sequence_ids))
+            parts.append(U4.pack(len(frame)))
+            parts.append(frame)
+    return encode_message(EMessageType.e_sequence_data, b"".join(parts), time)
+
+
+def encode_aux_sequence_data(sequences, time=0):
+    """Encode an AuxSequenceData message.\n
+       sequences is a list of (sequence_id, values) where values is a list of
+       (relative_time, value) and value a signed 24-bit integer"""
+    parts = [U2U2.pack(len(sequences), 0)]
+    for sequence_id, values in sequences:
+        parts.append(U2U2.pack(sequence_id, len(values)))
+        for relative_time, value in values:
+            parts.append(AUX_VALUE.pack(relative_time, value & 0xFFFFFF))
+    return encode_message(EMessageType.e_aux_sequence_data, b"".join(parts), time)
+
+
+def encode_data_quality(qualities, time=0):
+    """Encode a DataQuality message, qualities is a list of (quality_id, validity)"""
+    parts = [U2U2.pack(len(qualities), 0)]
+    for quality_id, validity in qualities:
+        parts.append(QUALITY_BLOCK.pack(quality_id, validity, 0))
+    return encode_message(EMessageType.e_data_quality, b"".join(parts), time)
+
+
+def encode_state(state, application_name="SLM", time=0):
+    """Encode a State message, state is a WebxiStream.State.EState or its value"""
+    return encode_message(EMessageType.e_state, U2U2.pack(_value(state), 0) + _string(application_name), time)
+
+
+def encode_status(channel_type, channel_id, status_type, value1=0, value2=0, text="", time=0):
+    """Encode a Status message"""
+    content = STATUS.pack(_value(channel_type), channel_id, _value(status_type), 0, value1, value2) + _string(text)
+    return encode_message(EMessageType.e_status, content, time)
+
+
+def encode_trigger(sequence_id, trigger_type, time=0):
+    """Encode a Trigger message, trigger_type is a WebxiStream.Trigger.ETriggerType or its value"""
+    return encode_message(EMessageType.e_trigger, U2U2.pack(sequence_id, _value(trigger_type)), time)
+
+
+def encode_node(changes, time=0):
+    """Encode a Node message, changes is a list of (flags, path, json)"""
+    parts = [U2U2.pack(len(changes), 0)]
+    for flags, path, json in changes:
+        parts.append(U2U2.pack(flags, 0) + _string(path) + _string(json))
+    return encode_message(EMessageType.e_node, b"".join(parts), time)
+
+
+def encode_sync(sync_id, time=0):
+    """Encode a Sync message"""
+    return encode_message(EMessageType.e_sync, U4.pack(sync_id), time)
+
+
+def encode_debug(text, time=0):
+    """Encode a Debug message"""
+    return encode_message(EMessageType.e_debug, _string(text), time)
+
+
+def encode_package(packages, time=0):
+    """Encode a Package message, packages is a list of (package_id, data)"""
+    parts = [U2U2.pack(len(packages), 0)]
+    for package_id, data in packages:
+        parts.append(U2U2.pack(package_id, len(data)))
+        parts.append(data)
+    return encode_message(EMessageType.e_package, b"".join(parts), time)
@@ -0,0 +1,236 @@
+# Hand written fast path for webxi_stream.py (the generated Kaitai parser).
+# The Kaitai parser reads sequence data one byte at a time into lists of ints,
+# this module unpacks the fixed fields with precompiled structs and returns the
+# payloads as memoryview slices of the original WebSocket message.
+
+import struct
+import kaitaistruct
+from kaitaistruct import KaitaiStream, BytesIO
+
+from .webxi_stream import WebxiStream
+
+# Precompiled formats for the fixed parts of a message, all little endian
+HEADER = struct.Struct("<2sHHHIQI")         # magic ... content_length, 24 bytes
+SEQUENCE_DATA = struct.Struct("<HBB")       # number_of_blocks, message_format, reserved
+RAW_BLOCK = struct.Struct("<HI")            # sequence_id, value_length
+U2 = struct.Struct("<H")
+U4 = struct.Struct("<I")
+
+MAGIC = b"\x42\x4B"
+
+EMessageType = WebxiStream.Header.EMessageType
+EMessageFormat = WebxiStream.SequenceData.EMessageFormat
+
+# Kaitai types used for the message types without a fast path
+KAITAI_CONTENT = {
+    EMessageType.e_state: WebxiStream.State,
+    EMessageType.e_sequence_data: WebxiStream.SequenceData,
+    EMessageType.e_debug: WebxiStream.Debug,
+    EMessageType.e_sync: WebxiStream.Sync,
+    EMessageType.e_aux_sequence_data: WebxiStream.AuxSequenceData,
+    EMessageType.e_package: WebxiStream.Package,
+    EMessageType.e_data_quality: WebxiStream.DataQuality,
+    EMessageType.e_node: WebxiStream.Node,
+    EMessageType.e_status: WebxiStream.Status,
+    EMessageType.e_trigger: WebxiStream.Trigger,
+}
+
+
+def _check_length(buf, end):
+    if end > len(buf):
+        raise EOFError("requested %s bytes, but only %s bytes available" % (end, len(buf)))
+
+
+class Header:
+    """Same fields as WebxiStream.Header, unpacked with a single struct call"""
+    __slots__ = ("magic", "header_length", "message_type", "content_version",
+                 "reserved2", "time", "content_length")
+
+    def __init__(self, message, offset=0):
+        (self.magic, self.header_length, message_type, self.content_version,
+         self.reserved2, self.time, self.content_length) = HEADER.unpack_from(message, offset)
+        if self.magic != MAGIC:
+            raise kaitaistruct.ValidationNotEqualError(MAGIC, self.magic, None, u"/types/header/seq/0")
+        self.message_type = KaitaiStream.resolve_enum(EMessageType, message_type)
+
+
+class RawSequenceDataBlock:
+    """Same fields as WebxiStream.RawSequenceDataBlock, values is a memoryview"""
+    __slots__ = ("sequence_id", "value_length", "values")
+
+    def __init__(self, sequence_id, value_length, values):
+        self.sequence_id = sequence_id
+        self.value_length = value_length
+        self.values = values
+
+
+class FrameSequenceDataBlock:
+    """Same fields as WebxiStream.FlacSequenceDataBlock and WebxiStream.Mp3SequenceDataBlock,
+    frame is a memoryview"""
+    __slots__ = ("number_of_sequences", "sequence_ids", "frame_length", "frame")
+
+    def __init__(self, number_of_sequences, sequence_ids, frame_length, frame):
+        self.number_of_sequences = number_of_sequences
+        self.sequence_ids = sequence_ids
+        self.frame_length = frame_length
+        self.frame = frame
+
+
+class SequenceData:
+    """Same fields as WebxiStream.SequenceData"""
+    __slots__ = ("number_of_blocks", "message_format", "reserved", "sequence_blocks")
+
+    def __init__(self, number_of_blocks, message_format, reserved, sequence_blocks):
+        self.number_of_blocks = number_of_blocks
+        self.message_format = message_format
+        self.reserved = reserved
+        self.sequence_blocks = sequence_blocks
+
+
+def decode_sequence_data(content, offset=0):
+    """Decode the content of a SequenceData message starting at offset.\n
+       The values/frames of the returned blocks are slices of content, no bytes are copied"""
+    content = content if isinstance(content, memoryview) else memoryview(content)
+    number_of_blocks, message_format, reserved = SEQUENCE_DATA.unpack_from(content, offset)
+    message_format = KaitaiStream.resolve_enum(EMessageFormat, message_format)
+    offset += SEQUENCE_DATA.size
+    blocks = [None] * number_of_blocks
+    if message_format == EMessageFormat.raw:
+        for i in range(number_of_blocks):
+            sequence_id, value_length = RAW_BLOCK.unpack_from(content, offset)
+            offset += RAW_BLOCK.size
+            end = offset + value_length
+            _check_length(content, end)
+            blocks[i] = RawSequenceDataBlock(sequence_id, value_length, content[offset:end])
+            offset = end
+    elif message_format == EMessageFormat.mp3 or message_format == EMessageFormat.flac:
+        for i in range(number_of_blocks):
+            number_of_sequences, = U2.unpack_from(content, offset)
+            offset += U2.size
+            sequence_ids = list(struct.unpack_from("<%dH" % number_of_sequences, content, offset))
+            offset += U2.size * number_of_sequences
+            frame_length, = U4.unpack_from(content, offset)
+            offset += U4.size
+            end = offset + frame_length
+            _check_length(content, end)
+            blocks[i] = FrameSequenceDataBlock(number_of_sequences, sequence_ids, frame_length, content[offset:end])
+            offset = end
+    # Unknown formats leave the blocks as None, as in the Kaitai parser
+    return SequenceData(number_of_blocks, message_format, reserved, blocks)
+
+
+class AuxSequenceDataBlock:
+    """Same fields as WebxiStream.AuxSequenceDataBlock, values is a structured array with the fields
+    relative_time and value (the sign extended 24-bit value, AuxValue.values.calc_value)"""
+    __slots__ = ("sequence_id", "number_of_values", "values")
+
+    def __init__(self, sequence_id, values):
+        self.sequence_id = sequence_id
+        self.number_of_values = len(values)
+        self.values = values
+
+
+class AuxSequenceData:
+    """Same fields as WebxiStream.AuxSequenceData, one block per block of the message.
+    sequences is the dict of sequence_id -> values as returned by webxi_batch.decode_aux_sequence_data,
+    with the values of blocks repeating a sequence_id joined"""
+    __slots__ = ("number_of_sequences", "reserved", "sequences", "aux_sequence_data_blocks")
+
+    def __init__(self, content):
+        # webxi_batch imports this module, so its decoder is imported when first used
+        from .webxi_batch import decode_aux_blocks, merge_aux_blocks
+        self.number_of_sequences, self.reserved = struct.unpack_from("<HH", content, 0)
+        blocks = decode_aux_blocks(content)
+        self.aux_sequence_data_blocks = [AuxSequenceDataBlock(sequence_id, values) for sequence_id, values in blocks]
+        self.sequences = merge_aux_blocks(blocks)
+
+
+def decode_kaitai_content(message_type, content):
+    """Decode content with the generated Kaitai type for message_type.\n
+       Unknown message types are returned as bytes, as in WebxiStream"""
+    content_type = KAITAI_CONTENT.get(message_type)
+    if content_type is None:
+        return bytes(content)
+    # The nested Kaitai types look up each other through _root, the WebxiStream class provides them all
+    return content_type(KaitaiStream(BytesIO(bytes(content))), None, WebxiStream)
+
+
+class WebxiFastStream:
+    """Drop-in replacement for WebxiStream.from_bytes(message).\n
+       Only the header is decoded up front, the content is decoded the first
+       time it is accessed. SequenceData content is decoded by decode_sequence_data,
+       AuxSequenceData by webxi_batch.decode_aux_sequence_data (values as NumPy arrays),
+       all other message types fall back to the Kaitai parser"""
+    __slots__ = ("header", "_raw_content", "_content")
+
+    def __init__(self, message):
+        message = message if isinstance(message, memoryview) else memoryview(message)
+        self.header = Header(message)
+        start = HEADER.size
+        end = start + self.header.content_length
+        _check_length(message, end)
+        self._raw_content = message[start:end]
+        self._content = None
+
+    @property
+    def content(self):
+        if self._content is None:
+            if self.header.message_type == EMessageType.e_sequence_data:
+                self._content = decode_sequence_data(self._raw_content)
+            elif self.header.message_type == EMessageType.e_aux_sequence_data:
+                self._content = AuxSequenceData(self._raw_content)
+            else:
+                self._content = decode_kaitai_content(self.header.message_type, self._raw_content)
+        return self._content
+
+    @property
+    def raw_content(self):
+        """The undecoded content, a memoryview of the message"""
+        return self._raw_content
+
+    @classmethod
+    def from_bytes(cls, message, message_types=None):
+        """Returns None without decoding anything if the message type is not in message_types"""
+        if message_types is not None and message_type_of(message) not in _type_values(message_types):
+            return None
+        return cls(message)
+
+
+def message_type_of(message):
+    """Returns the raw message type of a message, read directly from the header"""
+    return U2.unpack_from(message, 4)[0]
+
+
+def _type_values(message_types):
+    return {message_type.value if isinstance(message_type, EMessageType) else message_type
+            for message_type in message_types}
+
+
+class WebxiDispatcher:
+    """Calls the subscribed handlers with a WebxiFastStream for each message.\n
+       Messages of types without subscribers are dropped after reading the
+       message type, so they cost close to nothing. The dispatcher can be given
+       directly as the packetHandler of websocket_handler.next_async_websocket"""
+
+    def __init__(self):
+        self.handlers = {}
+
+    def subscribe(self, message_type, handler):
+        """Call handler(package) for every message of message_type"""
+        key, = _type_values([message_type])
+        self.handlers.setdefault(key, []).append(handler)
+
+    def unsubscribe(self, message_type, handler):
+        key, = _type_values([message_type])
+        self.handlers[key].remove(handler)
+        if not self.handlers[key]:
+            del self.handlers[key]
+
+    def __call__(self, message):
+        handlers = self.handlers.get(message_type_of(message))
+        if not handlers:
+            return None
+        package = WebxiFastStream(message)
+        for handler in handlers:
+            handler(package)
+        return package